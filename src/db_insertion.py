@@ -1,60 +1,127 @@
-import pandas as pd
-import iris
-from sentence_transformers import SentenceTransformer
-from langchain.agents import create_agent
-from langchain.agents.middleware import SummarizationMiddleware
-from langgraph.checkpoint.memory import InMemorySaver
-from openai import OpenAI
+import io
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
 
-from langchain_openai import ChatOpenAI
-from langchain.agents import create_agent
-from langchain.agents.middleware import SummarizationMiddleware
-from langgraph.checkpoint.memory import InMemorySaver
+from embedding_cache import get_embedding_cache
+from iris_pool import get_iris_pool
+from embedding_model import EMBED_BATCH_SIZE, get_embedding_service
 
-model = SentenceTransformer('all-MiniLM-L6-v2') 
+# Same service (and model instance) as the chatbot, loaded on first encode
+embedding_service = get_embedding_service()
+embedding_cache = get_embedding_cache(embedding_service.cache_name)
+
+# CPU encode processes for bulk loads (0/1 = encode in-process)
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+# Multi-process pool of the running bulk load (see encode_pool)
+_active_pool = None
 
 def vectorize_content(content):
-    embeddings = model.encode([content], normalize_embeddings=True, show_progress_bar=True)
+    return embedding_cache.encode([content], embedding_service.encode)
+
+
+def vectorize_batch(contents, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS):
+    """
+    Embed many texts at once, reusing cached vectors for text seen before.
+    Returns a float32 matrix of shape (len(contents), dim).
+    """
+    if not contents:
+        return np.empty((0, embedding_service.dimension), dtype=np.float32)
+    return embedding_cache.encode(
+        contents,
+        lambda texts: _encode_batch(texts, batch_size, workers),
+    )
+
+
+@contextmanager
+def encode_pool(workers=EMBED_WORKERS):
+    """
+    Start the multi-process encode pool once for a whole bulk load; every
+    insert_chunks call inside the block reuses it instead of starting (and
+    loading the model into) new worker processes per batch.
+    """
+    global _active_pool
+    if not workers or workers <= 1 or _active_pool is not None:
+        yield
+        return
+
+    model = embedding_service.model
+    _active_pool = model.start_multi_process_pool(target_devices=["cpu"] * workers)
+    try:
+        yield
+    finally:
+        pool, _active_pool = _active_pool, None
+        model.stop_multi_process_pool(pool)
+
+
+def _encode_batch(contents, batch_size, workers):
+    """
+    In-process encodes go through the shared service (length-sorted batches).
+    With workers > 1 the texts are spread over a multi-process pool instead:
+    the one of the surrounding encode_pool block, or a pool just for this call.
+    """
+    if not workers or workers <= 1:
+        return embedding_service.encode(contents, batch_size=batch_size)
+
+    model = embedding_service.model
+    order = np.argsort([len(c) for c in contents], kind="stable")[::-1]
+    sorted_contents = [contents[i] for i in order]
+
+    with encode_pool(workers):
+        sorted_embeddings = model.encode_multi_process(
+            sorted_contents,
+            _active_pool,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+        )
+
+    embeddings = np.empty_like(sorted_embeddings, dtype=np.float32)
+    embeddings[order] = sorted_embeddings
     return embeddings
 
 
-def insert_chunks(chunks):
-    conn = iris.connect("localhost", 32782, "DEMO", "_SYSTEM", "ISCDEMO")
-    cursor = conn.cursor()
+def vectors_to_strings(embeddings):
+    """Serialize a 2-D embedding matrix into TO_VECTOR-ready CSV strings, one per row."""
+    if len(embeddings) == 0:
+        return []
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.asarray(embeddings, dtype=np.float32), fmt="%.8g", delimiter=",")
+    return buffer.getvalue().splitlines()
 
-    table_name = "VectorSearch.ORGstruct"
 
-    rows_to_insert = []
+TABLE_NAME = "VectorSearch.ORGstruct"
+INSERT_SQL = f"""
+    INSERT INTO {TABLE_NAME} (id, filename, content, vector)
+    VALUES (?, ?, ?, TO_VECTOR(?))
+"""
+# Rows per executemany round trip; each insert_chunks call commits once
+INSERT_BATCH_ROWS = int(os.getenv("IRIS_WRITE_BATCH_ROWS", "500"))
 
-    for chunk in chunks:
-        print("the chunk is ", chunk)
-        content = chunk["content"]
-        filename = chunk["filename"]
-        id = chunk["id"]
 
-        # Vectorize properly
-        embedding = vectorize_content(content)        # returns numpy array
-        embedding_str = ",".join(map(str, embedding)) # convert to CSV string
+def insert_chunks(chunks, timings=None):
+    """Embed and insert chunks; per-stage seconds are added to timings if given."""
+    timings = timings if timings is not None else {}
 
-        print("inserting chunk ", chunk)
+    started = time.perf_counter()
+    contents = [chunk["content"] for chunk in chunks]
+    embedding_strs = vectors_to_strings(vectorize_batch(contents))
+    timings["embed"] = timings.get("embed", 0.0) + time.perf_counter() - started
 
-        rows_to_insert.append([
-            int(id),
-            filename,
-            content,
-            embedding_str
-        ])
+    rows_to_insert = [
+        # Section numbers ("3.1") are ids too; the id column is VARCHAR
+        [str(chunk["id"]), chunk["filename"], chunk["content"], embedding_str]
+        for chunk, embedding_str in zip(chunks, embedding_strs)
+    ]
 
-    insert_query = f"""
-        INSERT INTO {table_name} (id, filename, content, vector)
-        VALUES (?, ?, ?, TO_VECTOR(?))
-    """
-    print("the insert query is ", insert_query)
+    def write(conn):
+        for start in range(0, len(rows_to_insert), INSERT_BATCH_ROWS):
+            conn.executemany(INSERT_SQL, rows_to_insert[start:start + INSERT_BATCH_ROWS])
+        conn.commit()
 
-    cursor.executemany(insert_query, rows_to_insert)
-    conn.commit()
-    conn.close()
+    started = time.perf_counter()
+    # Pooled connection instead of a fresh connect per call
+    get_iris_pool().run(write)
+    timings["insert"] = timings.get("insert", 0.0) + time.perf_counter() - started
 
     print(f"Inserted {len(rows_to_insert)} chunks.")
-
-        
\ No newline at end of file
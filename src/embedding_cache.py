@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+
+# ------------------------------------------
+# CONFIG
+# ------------------------------------------
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./cache/embeddings.sqlite")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+
+def normalize_text(text: str) -> str:
+    """NFC + collapsed whitespace, so cosmetic differences share one entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    """
+    Persistent SQLite cache of embeddings keyed by sha256(model name + text).
+    Entries are evicted least-recently-used once max_entries is exceeded.
+    """
+
+    def __init__(self, model_name: str, path: str = EMBED_CACHE_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        payload = f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    # ------------------------------------------
+    # LOOKUP / STORE
+    # ------------------------------------------
+
+    def get_many(self, texts: list[str]) -> dict[int, np.ndarray]:
+        """Return {index: vector} for every text already in the cache."""
+        keys = [self.key(t) for t in texts]
+        found = {}
+        with self._lock:
+            # SQLite limits bound parameters per statement, so query in slices
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                found.update({k: np.frombuffer(v, dtype=np.float32) for k, v in rows})
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+
+            result = {i: found[k] for i, k in enumerate(keys) if k in found}
+            self.hits += len(result)
+            self.misses += len(texts) - len(result)
+        return result
+
+    def put_many(self, texts: list[str], vectors) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = time.time()
+        rows = [
+            (self.key(t), int(v.shape[0]), v.tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def encode(self, texts: list[str], encode_fn) -> np.ndarray:
+        """
+        Embed texts, calling encode_fn(list_of_texts) -> matrix only for misses.
+        Returns a float32 matrix in input order.
+        """
+        texts = list(texts)
+        cached = self.get_many(texts)
+        missing = [i for i in range(len(texts)) if i not in cached]
+
+        fresh = {}
+        if missing:
+            # Repeated texts (e.g. identical table rows) are encoded only once
+            unique = {}
+            for i in missing:
+                unique.setdefault(self.key(texts[i]), texts[i])
+            unique_texts = list(unique.values())
+            vectors = np.asarray(encode_fn(unique_texts), dtype=np.float32)
+            self.put_many(unique_texts, vectors)
+            by_key = dict(zip(unique, vectors))
+            fresh = {i: by_key[self.key(texts[i])] for i in missing}
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([cached[i] if i in cached else fresh[i] for i in range(len(texts))])
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# ------------------------------------------
+# SHARED INSTANCES
+# ------------------------------------------
+
+_caches: dict[tuple[str, str], EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str, path: str = EMBED_CACHE_PATH) -> EmbeddingCache:
+    """One cache per (model, file) in the process, shared by ingestion and chat."""
+    with _caches_lock:
+        cache = _caches.get((model_name, path))
+        if cache is None:
+            cache = EmbeddingCache(model_name, path)
+            _caches[(model_name, path)] = cache
+        return cache
@@ -0,0 +1,184 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+# ------------------------------------------
+# CONFIG
+# ------------------------------------------
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# "torch" (default), "onnx", or "onnx-int8" (dynamically quantized CPU model)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_qint8_avx2.onnx")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# Concurrent query encodes are merged for up to this long / this many texts
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+
+
+class EmbeddingService:
+    """
+    The one embedding model of the process, shared by chat and ingestion.
+
+    The model is loaded on first use. Forward passes are serialized by a lock
+    (parallel passes only fight over the same CPU threads), texts are run in
+    length-sorted batches, and single query encodes from concurrent requests
+    are merged into one pass by a small micro-batching thread.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+        self._queries: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._batcher = None
+        self.query_count = 0
+        self.query_batches = 0
+
+    # ---- model ----
+
+    @property
+    def cache_name(self) -> str:
+        """
+        Key for the embedding cache; quantized vectors must not mix with fp32
+        ones. Known before the model loads, so _load never switches backends.
+        """
+        return self.model_name if self.backend == "torch" else f"{self.model_name}:{self.backend}"
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        # sentence-transformers (and torch) are only imported here, so modules
+        # that merely reference the service stay cheap to import
+        from sentence_transformers import SentenceTransformer
+
+        if self.backend in ("onnx", "onnx-int8"):
+            model_kwargs = {"file_name": EMBEDDING_ONNX_INT8_FILE} if self.backend == "onnx-int8" else None
+            try:
+                return SentenceTransformer(self.model_name, backend="onnx", model_kwargs=model_kwargs)
+            except Exception as e:  # optimum/onnxruntime missing or old sentence-transformers
+                # No silent torch fallback: its vectors would be cached under the ONNX key
+                raise RuntimeError(
+                    f"EMBEDDING_BACKEND={self.backend} could not be loaded ({e}); "
+                    "install optimum[onnxruntime] or set EMBEDDING_BACKEND=torch"
+                ) from e
+        return SentenceTransformer(self.model_name)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    # ---- encoding ----
+
+    def encode(self, texts: list[str], batch_size: int = EMBED_BATCH_SIZE, normalize: bool = True) -> np.ndarray:
+        """
+        Embed texts in batches sorted by length (less padding per batch).
+        Returns a float32 matrix in input order.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        order = np.argsort([len(t) for t in texts], kind="stable")[::-1]
+        model = self.model
+        with self._encode_lock:
+            sorted_vectors = model.encode(
+                [texts[i] for i in order],
+                batch_size=batch_size,
+                normalize_embeddings=normalize,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            )
+
+        vectors = np.empty((len(texts), sorted_vectors.shape[1]), dtype=np.float32)
+        vectors[order] = sorted_vectors
+        return vectors
+
+    def encode_query(self, text: str, timeout: float | None = 30) -> np.ndarray:
+        """One normalized query vector, batched together with concurrent callers."""
+        self._ensure_batcher()
+        future: Future = Future()
+        self._queries.put((text, future))
+        return future.result(timeout)
+
+    def _ensure_batcher(self):
+        if self._batcher is None:
+            with self._load_lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(target=self._batch_queries, name="query-encoder", daemon=True)
+                    self._batcher.start()
+
+    def _batch_queries(self):
+        window = QUERY_BATCH_WINDOW_MS / 1000
+        while True:
+            batch = [self._queries.get()]
+            deadline = time.monotonic() + window
+            while len(batch) < QUERY_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queries.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                vectors = self.encode([text for text, _ in batch], batch_size=QUERY_BATCH_MAX)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.query_count += len(batch)
+            self.query_batches += 1
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "loaded": self.loaded,
+            "queries": self.query_count,
+            "query_batches": self.query_batches,
+            "mean_query_batch": self.query_count / self.query_batches if self.query_batches else 0.0,
+        }
+
+
+# ------------------------------------------
+# SHARED INSTANCE
+# ------------------------------------------
+
+_service: EmbeddingService | None = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """One service (and so one model in memory) per process."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService()
+        return _service
+
+
+def embedding_model_loaded() -> bool:
+    return _service is not None and _service.loaded
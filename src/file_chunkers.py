@@ -2,11 +2,14 @@ import os
 import re
 import csv
 import json
+import time
 import mammoth
 import subprocess
 import unicodedata
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from to_json import excel_to_json
-from db_insertion import insert_chunks
+from db_insertion import insert_chunks, encode_pool
 # import pdfplumber
 
 # ------------------------------------------
@@ -162,31 +165,115 @@ def save_chunks(chunks: list[dict], output_path: str):
 # OPTIONAL: PROCESS ENTIRE FOLDERS
 # ------------------------------------------
 
-def process_folder(folder_path: str) -> list[dict]:
+def parse_file(path: str) -> tuple[list[dict], float]:
     """
-    Loads every supported file in a folder and returns all chunks as a list.
+    Load and chunk one file. Runs inside a worker process.
+    Returns the chunks and the seconds spent parsing.
     """
-    all_chunks = []
-
-    for filename in os.listdir(folder_path):
-        full = os.path.join(folder_path, filename)
-        if not os.path.isfile(full):
-            continue
+    started = time.perf_counter()
+    filename = os.path.basename(path)
+    document_data = load_document(path)
+
+    if not document_data:
+        chunks = []
+    elif os.path.splitext(path)[1].lower() == ".xlsx":
+        # excel_to_json already returns chunk dicts
+        chunks = document_data
+    else:
+        chunks = chunk_document(document_data, filename)
+
+    return chunks, time.perf_counter() - started
+
+
+def process_folder(
+    folder_path: str,
+    workers: int | None = None,
+    max_in_flight: int | None = None,
+    insert_batch_size: int = 256,
+) -> list[dict]:
+    """
+    Loads every supported file in a folder, inserts the chunks and returns them.
 
-        text = load_document(full)
-        if not text:
-            continue
+    Files are parsed in a process pool with at most max_in_flight files queued.
+    Finished chunks are streamed into batched embed/insert calls while the
+    remaining files are still parsing. A file that fails is reported and skipped.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
 
-        ext = os.path.splitext(full)[1].lower()
+    paths = [
+        os.path.join(folder_path, filename)
+        for filename in sorted(os.listdir(folder_path))
+        if os.path.isfile(os.path.join(folder_path, filename))
+    ]
 
-        if ext == ".xlsx":
-            print("we are here")
-            all_chunks.extend(text)
-            return text
-        chunks = chunk_document(text, filename)
-        all_chunks.extend(chunks)
+    all_chunks = []
+    pending_batch = []
+    errors = {}
+    timings = defaultdict(float)
+    started = time.perf_counter()
+
+    def flush():
+        if not pending_batch:
+            return
+        try:
+            insert_chunks(pending_batch, timings=timings)
+        except Exception as e:
+            # Batches mix files; retry file by file so one bad file does not
+            # cost the others their rows
+            by_file = defaultdict(list)
+            for chunk in pending_batch:
+                by_file[chunk["filename"]].append(chunk)
+            print(f"Failed to insert batch of {len(pending_batch)} chunks ({e}), retrying per file")
+            for filename, file_chunks in by_file.items():
+                try:
+                    insert_chunks(file_chunks, timings=timings)
+                except Exception as file_error:
+                    print(f"Failed to insert {len(file_chunks)} chunks of {filename}: {file_error}")
+                    errors[filename] = f"insert failed: {file_error}"
+        pending_batch.clear()
+
+    # One embedding worker pool for all insert batches of this run
+    with encode_pool(), ProcessPoolExecutor(max_workers=workers) as pool:
+        path_iter = iter(paths)
+        in_flight = {}
+
+        def submit_next():
+            path = next(path_iter, None)
+            if path is not None:
+                in_flight[pool.submit(parse_file, path)] = path
+
+        for _ in range(max_in_flight):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = in_flight.pop(future)
+                submit_next()
+                try:
+                    chunks, parse_seconds = future.result()
+                except Exception as e:
+                    print(f"Failed to parse {path}: {e}")
+                    errors[os.path.basename(path)] = f"parse failed: {e}"
+                    continue
+
+                timings["parse"] += parse_seconds
+                all_chunks.extend(chunks)
+                pending_batch.extend(chunks)
+                if len(pending_batch) >= insert_batch_size:
+                    flush()
+
+        flush()
+
+    timings["wall"] = time.perf_counter() - started
+    print(
+        f"Processed {len(paths)} files into {len(all_chunks)} chunks with {workers} workers; "
+        + ", ".join(f"{stage}: {seconds:.2f}s" for stage, seconds in timings.items())
+    )
+    for filename, error in errors.items():
+        print(f"  {filename}: {error}")
 
-    insert_chunks(all_chunks)
     return all_chunks
 
 
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+
+# ------------------------------------------
+# CONFIG
+# ------------------------------------------
+
+INGEST_JOBS_PATH = os.getenv("INGEST_JOBS_PATH", "./cache/ingest_jobs.sqlite")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# Pipeline stages in order; a job's "stage" is the last one it completed
+STAGES = ("queued", "parsed", "chunked", "embedded", "indexed")
+
+
+class IngestQueue:
+    """
+    Persistent queue of document ingestion jobs.
+
+    Jobs live in SQLite so a restart picks up everything that was still
+    queued or half processed (every stage is safe to redo). A fixed number
+    of worker threads run pipeline(job, report) for each job; the pipeline
+    calls report(stage, **info) after each stage so status reads can show
+    progress.
+    """
+
+    def __init__(self, pipeline, path: str = INGEST_JOBS_PATH, workers: int = INGEST_WORKERS):
+        self.pipeline = pipeline
+        self.path = path
+        self.workers = max(1, workers)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                job_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                path TEXT NOT NULL,
+                sha256 TEXT,
+                status TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ingest_jobs_status ON ingest_jobs (status)")
+        self._conn.commit()
+
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        # One job per file at a time: filename -> job waiting for the running one
+        self._running_files: set[str] = set()
+        self._waiting: dict[str, str] = {}
+
+    # ------------------------------------------
+    # LIFECYCLE
+    # ------------------------------------------
+
+    def start(self) -> None:
+        """Start the workers and re-enqueue jobs left over from a previous run."""
+        if self._threads:
+            return
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM ingest_jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE ingest_jobs SET status = 'queued' WHERE status = 'running'"
+            )
+            self._conn.commit()
+        for (job_id,) in rows:
+            self._queue.put(job_id)
+        if rows:
+            print(f"Resuming {len(rows)} ingestion job(s)")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: str) -> None:
+        # Claim atomically so submit() never reuses a job that already started.
+        # Two jobs of one file would diff against the same stored rows and both
+        # insert the new chunks, so a re-upload waits for the running job.
+        with self._lock:
+            row = self._conn.execute("SELECT filename FROM ingest_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            filename = row[0]
+            if filename in self._running_files:
+                self._waiting[filename] = job_id
+                return
+            claimed = self._conn.execute(
+                "UPDATE ingest_jobs SET status = 'running', updated_at = ? WHERE job_id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            ).rowcount
+            self._conn.commit()
+            if not claimed:
+                return
+            self._running_files.add(filename)
+
+        try:
+            self._execute(job_id)
+        finally:
+            with self._lock:
+                self._running_files.discard(filename)
+                waiting = self._waiting.pop(filename, None)
+            if waiting is not None:
+                self._queue.put(waiting)
+
+    def _execute(self, job_id: str) -> None:
+        job = self.get(job_id)
+        started = time.monotonic()
+
+        def report(stage: str, **info):
+            job["progress"][stage] = {"seconds": round(time.monotonic() - started, 3), **info}
+            self._update(job_id, stage=stage, progress=job["progress"])
+
+        try:
+            self.pipeline(job, report)
+        except Exception as e:
+            print(f"Ingestion job {job_id} ('{job['filename']}') failed: {e}")
+            self._update(job_id, status="failed", error=str(e))
+            return
+        self._update(job_id, status="done")
+
+    # ------------------------------------------
+    # JOBS
+    # ------------------------------------------
+
+    def submit(self, path: str, filename: str, sha256: str | None = None) -> dict:
+        """
+        Enqueue a file for ingestion and return its job. A job for the same
+        file that has not started yet is reused, since it will read the
+        newest file anyway.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id FROM ingest_jobs WHERE filename = ? AND status = 'queued'", (filename,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE ingest_jobs SET sha256 = ?, updated_at = ? WHERE job_id = ?", (sha256, now, row[0])
+                )
+                self._conn.commit()
+                job_id = row[0]
+            else:
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO ingest_jobs VALUES (?, ?, ?, ?, 'queued', 'queued', '{}', NULL, ?, ?)",
+                    (job_id, filename, path, sha256, now, now),
+                )
+                self._conn.commit()
+                self._queue.put(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM ingest_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM ingest_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def _update(self, job_id: str, **fields) -> None:
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE ingest_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id)
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job_id, filename, path, sha256, status, stage, progress, error, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "filename": filename,
+            "path": path,
+            "sha256": sha256,
+            "status": status,
+            "stage": stage,
+            "progress": json.loads(progress),
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM ingest_jobs GROUP BY status"
+            ).fetchall()
+        return {"pending": self._queue.qsize(), **dict(rows)}
@@ -0,0 +1,195 @@
+import os
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+import iris
+
+# ------------------------------------------
+# CONFIG
+# ------------------------------------------
+
+IRIS_HOST = os.getenv("IRIS_HOST", "localhost")
+IRIS_PORT = int(os.getenv("IRIS_PORT", "32782"))
+IRIS_NAMESPACE = os.getenv("IRIS_NAMESPACE", "DEMO")
+IRIS_USER = os.getenv("IRIS_USER", "_SYSTEM")
+IRIS_PASSWORD = os.getenv("IRIS_PASSWORD", "ISCDEMO")
+
+IRIS_POOL_SIZE = int(os.getenv("IRIS_POOL_SIZE", "4"))
+# Connections idle longer than this are pinged before being handed out
+IRIS_HEALTH_CHECK_SECONDS = float(os.getenv("IRIS_HEALTH_CHECK_SECONDS", "30"))
+IRIS_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("IRIS_ACQUIRE_TIMEOUT_SECONDS", "30"))
+
+
+def connect():
+    return iris.connect(IRIS_HOST, IRIS_PORT, IRIS_NAMESPACE, IRIS_USER, IRIS_PASSWORD)
+
+
+class PooledConnection:
+    """
+    One IRIS connection plus a cursor per SQL text.
+    Executing the same statement text on the same cursor lets the driver
+    reuse its prepared form instead of preparing it again for every call.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._statements = {}
+
+    def statement(self, sql: str):
+        cursor = self._statements.get(sql)
+        if cursor is None:
+            cursor = self.conn.cursor()
+            self._statements[sql] = cursor
+        return cursor
+
+    def execute(self, sql: str, params=()):
+        cursor = self.statement(sql)
+        cursor.execute(sql, list(params))
+        return cursor
+
+    def executemany(self, sql: str, rows):
+        cursor = self.statement(sql)
+        cursor.executemany(sql, rows)
+        return cursor
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def is_alive(self) -> bool:
+        try:
+            self.execute("SELECT 1").fetchall()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        self.closed = True
+        for cursor in self._statements.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._statements.clear()
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class IrisPool:
+    """
+    Small thread-safe pool of IRIS connections.
+
+    At most `size` connections exist; callers wait for a free one. Idle
+    connections are health-checked before reuse, and a connection that fails
+    is rolled back, or dropped and replaced if it no longer answers.
+    """
+
+    def __init__(self, size: int = IRIS_POOL_SIZE, connect_fn=connect,
+                 health_check_seconds: float = IRIS_HEALTH_CHECK_SECONDS):
+        self.size = max(1, size)
+        self.connect_fn = connect_fn
+        self.health_check_seconds = health_check_seconds
+
+        self._idle: "queue.LifoQueue[PooledConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.created = 0
+        self.reconnects = 0
+
+    def _checkout(self) -> PooledConnection:
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            pooled = None
+
+        if pooled is not None and time.monotonic() - pooled.last_used > self.health_check_seconds:
+            if not pooled.is_alive():
+                pooled.close()
+                pooled = None
+                self.reconnects += 1
+
+        if pooled is None:
+            pooled = PooledConnection(self.connect_fn())
+            self.created += 1
+        return pooled
+
+    @contextmanager
+    def connection(self, timeout: float = IRIS_ACQUIRE_TIMEOUT_SECONDS):
+        """Borrow a connection; uncommitted work is rolled back on error."""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"no IRIS connection free after {timeout}s")
+
+        pooled = None
+        try:
+            pooled = self._checkout()
+            yield pooled
+        except BaseException:
+            if pooled is not None:
+                try:
+                    pooled.rollback()
+                except Exception:
+                    # Broken connection: do not hand it out again
+                    pooled.close()
+                    self.reconnects += 1
+            raise
+        finally:
+            if pooled is not None and not pooled.closed:
+                pooled.last_used = time.monotonic()
+                self._idle.put(pooled)
+            self._slots.release()
+
+    def run(self, fn, retries: int = 1):
+        """
+        fn(connection) on a pooled connection. If it fails because the
+        connection died, it is retried on a fresh one; other errors propagate.
+        Only use for work that is safe to repeat (reads, or a whole transaction).
+        """
+        for attempt in range(retries + 1):
+            with self.connection() as pooled:
+                try:
+                    return fn(pooled)
+                except Exception:
+                    if attempt >= retries or pooled.is_alive():
+                        raise
+                    pooled.close()
+                    self.reconnects += 1
+                    print("IRIS connection lost, reconnecting...")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "created": self.created,
+            "idle": self._idle.qsize(),
+            "reconnects": self.reconnects,
+        }
+
+
+# ------------------------------------------
+# SHARED INSTANCE
+# ------------------------------------------
+
+_pool: IrisPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_iris_pool() -> IrisPool:
+    """One pool per process, shared by the chatbot and bulk ingestion."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = IrisPool()
+        return _pool
@@ -1,22 +1,122 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
 import json
 import base64
+import binascii
 import os
+import time
+import threading
 import unicodedata
 import mimetypes
+from functools import lru_cache
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
 
-from file_chunkers import load_document, chunk_document, save_chunks
-
-
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import json
-from model.main import RAGChatbot
 from dotenv import load_dotenv
 
-rag_chatbot = RAGChatbot()
+# Before the local imports below: they read FILES_PATH, IRIS_*, EMBEDDING_* at import time
+load_dotenv()
 
-UPLOAD_DIR = os.getenv("FILES_PATH")
+# Resolved once at startup and shared with the chatbot's send_to_uploads
+from upload_store import (
+    UPLOAD_DIR, MAX_UPLOAD_BYTES, UploadTooLarge, MultipartReader,
+    upload_index, receive_upload, safe_upload_name, iter_body,
+)
+from ingest_jobs import IngestQueue
 BASE_URL = "http://localhost:8000/files"
+
+# ---- Staged startup ----
+# The port is bound before anything heavy is imported. The chatbot (LangChain,
+# torch, the embedding model) is loaded by a background thread; until it is
+# ready chat requests wait up to STARTUP_WAIT_SECONDS and then get a 503.
+STARTUP_WAIT_SECONDS = float(os.getenv("STARTUP_WAIT_SECONDS", "30"))
+
+rag_chatbot = None
+chatbot_ready = threading.Event()
+startup_error = None
+
+
+class ChatbotNotReady(Exception):
+    pass
+
+
+def load_chatbot():
+    global rag_chatbot, startup_error
+    started = time.monotonic()
+    try:
+        from model.main import RAGChatbot
+        chatbot = RAGChatbot()
+        chatbot.warm_up()
+        rag_chatbot = chatbot
+        print(f"Chatbot ready after {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        startup_error = e
+        print(f"Chatbot failed to load: {e}")
+    finally:
+        chatbot_ready.set()
+
+
+def get_chatbot(timeout=STARTUP_WAIT_SECONDS):
+    if not chatbot_ready.wait(timeout) or rag_chatbot is None:
+        raise ChatbotNotReady(str(startup_error) if startup_error else "still starting")
+    return rag_chatbot
+
+
+# ---- Concurrency limits ----
+# Worker threads that actually run handlers, plus how many accepted
+# connections may wait for a free worker before we answer 503.
+MAX_WORKERS = int(os.getenv("SERVER_WORKERS", "16"))
+MAX_QUEUED = int(os.getenv("SERVER_QUEUE_SIZE", "64"))
+
+# Per-route caps so slow LLM calls cannot starve listings and downloads.
+ROUTE_LIMITS = {
+    "chat": int(os.getenv("CHAT_CONCURRENCY", "8")),
+    "upload": int(os.getenv("UPLOAD_CONCURRENCY", "2")),
+    "files": int(os.getenv("FILES_CONCURRENCY", "32")),
+    "listing": int(os.getenv("LISTING_CONCURRENCY", "8")),
+}
+ROUTE_WAIT_SECONDS = float(os.getenv("ROUTE_WAIT_SECONDS", "5"))
+
+# JSON bodies (chat, legacy base64 upload) are read into memory; cap them.
+# A base64 upload is ~4/3 of the file, hence the headroom over MAX_UPLOAD_BYTES.
+MAX_JSON_BYTES = int(os.getenv("MAX_JSON_MB", "50")) * 1024 * 1024
+BUSY_BODY = b'{"error":"server busy, try again"}'
+route_semaphores = {
+    route: threading.BoundedSemaphore(limit) for route, limit in ROUTE_LIMITS.items()
+}
+
+
+@lru_cache(maxsize=256)
+def guess_mime(ext):
+    mime, _ = mimetypes.guess_type("file" + ext)
+    return mime or "application/octet-stream"
+
+
+def parse_byte_range(header, size):
+    """
+    Parse a single 'bytes=a-b' / 'bytes=a-' / 'bytes=-n' range.
+    Returns (start, end) inclusive, or None if it cannot be satisfied.
+    Multi-range requests are answered with the first range only.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    first, _, last = spec.split(",")[0].strip().partition("-")
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix <= 0 or size <= 0:
+                return None
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
 def debug_unicode(label, s):
     print(f"{label}: {s!r}")
     print("Codepoints:", [hex(ord(c)) for c in s])
@@ -26,26 +126,67 @@ class SimpleHandler(BaseHTTPRequestHandler):
     # Utility: add CORS headers
     def _send_cors_headers(self):
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Session-Id, X-Filename, X-Date-Of-Creation, Range, If-None-Match, If-Modified-Since")
+        self.send_header("Access-Control-Expose-Headers", "ETag, Last-Modified, Content-Range, Accept-Ranges")
 
-    # ---- Static file serving ----
-    def handle_file_serve(self):
-        upload_dir = UPLOAD_DIR
+    def _send_json(self, status, payload):
+        self.send_response(status)
+        self._send_cors_headers()
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
+
+    # ---- Backpressure ----
+    def _acquire_route(self, route):
+        """Take a slot for the route, waiting briefly; False when saturated."""
+        semaphore = route_semaphores.get(route)
+        if semaphore is None:
+            return True
+        return semaphore.acquire(timeout=ROUTE_WAIT_SECONDS)
+
+    def _release_route(self, route):
+        semaphore = route_semaphores.get(route)
+        if semaphore is not None:
+            semaphore.release()
+
+    def _send_busy(self):
+        self.send_response(503)
+        self._send_cors_headers()
+        self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(BUSY_BODY)
 
-        raw_filename = self.path.replace("/files/", "")
+    def _run_limited(self, route, handler):
+        if not self._acquire_route(route):
+            return self._send_busy()
+        try:
+            return handler()
+        finally:
+            self._release_route(route)
+
+    # ---- Static file serving ----
+    def handle_file_serve(self, head_only=False):
+        raw_filename = self.path.split("?", 1)[0].replace("/files/", "", 1)
 
         # NEW: decode %CC%81 etc.
-        from urllib.parse import unquote
         decoded_filename = unquote(raw_filename)
 
         # Normalize Unicode (macOS compatibility)
         safe_filename = unicodedata.normalize("NFC", decoded_filename)
 
-
-        file_path = os.path.join(upload_dir, safe_filename)
-
-        if not os.path.isfile(file_path):
+        # The in-memory upload index answers "does it exist"; no path outside UPLOAD_DIR
+        known = bool(safe_filename) and os.path.basename(safe_filename) == safe_filename \
+            and upload_index.stat(safe_filename) is not None
+        f = None
+        if known:
+            try:
+                f = open(os.path.join(UPLOAD_DIR, safe_filename), "rb")
+            except FileNotFoundError:
+                upload_index.remove(safe_filename)
+
+        if f is None:
             self.send_response(404)
             self._send_cors_headers()
             self.send_header("Content-Type", "text/plain")
@@ -53,18 +194,69 @@ class SimpleHandler(BaseHTTPRequestHandler):
             self.wfile.write(b"File not found")
             return
 
-        mime, _ = mimetypes.guess_type(file_path)
-        mime = mime or "application/octet-stream"
-
-        with open(file_path, "rb") as f:
-            content = f.read()
+        with f:
+            # Size and ETag from the open file itself: documents are rewritten in
+            # place (session flushes), which the cached index stat would miss
+            st = os.fstat(f.fileno())
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            last_modified = formatdate(st.st_mtime, usegmt=True)
+
+            if self._not_modified(etag, st.st_mtime):
+                self.send_response(304)
+                self._send_cors_headers()
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                return
+
+            start, end = 0, st.st_size - 1
+            status = 200
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and (not if_range or if_range == etag):
+                byte_range = parse_byte_range(range_header, st.st_size)
+                if byte_range is None:
+                    self.send_response(416)
+                    self._send_cors_headers()
+                    self.send_header("Content-Range", f"bytes */{st.st_size}")
+                    self.end_headers()
+                    return
+                start, end = byte_range
+                status = 206
+            length = max(end - start + 1, 0)
+
+            self.send_response(status)
+            self._send_cors_headers()
+            self.send_header("Content-Type", guess_mime(os.path.splitext(safe_filename)[1].lower()))
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Cache-Control", "no-cache")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{st.st_size}")
+            self.end_headers()
 
-        self.send_response(200)
-        self._send_cors_headers()
-        self.send_header("Content-Type", mime)
-        self.send_header("Content-Length", str(len(content)))
-        self.end_headers()
-        self.wfile.write(content)
+            if head_only or length == 0:
+                return
+            try:
+                # Zero-copy where the OS supports it; never buffers the whole file
+                self.connection.sendfile(f, offset=start, count=length)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def _not_modified(self, etag, mtime):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return etag in tags or "*" in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
 
     # ---- OPTIONS (CORS) ----
     def do_OPTIONS(self):
@@ -74,17 +266,10 @@ class SimpleHandler(BaseHTTPRequestHandler):
 
     # ---- List uploaded files ----
     def handle_uploads_get(self):
-        # Ensure upload folder exists
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-        files = []
-        for filename in os.listdir(UPLOAD_DIR):
-            path = os.path.join(UPLOAD_DIR, filename)
-            if os.path.isfile(path):
-                files.append({
-                    "name": filename,
-                    "link": f"{BASE_URL}/{filename}"
-                })
+        files = [
+            {"name": filename, "link": f"{BASE_URL}/{filename}"}
+            for filename in upload_index.names()
+        ]
 
         self.send_response(200)
         self._send_cors_headers()
@@ -92,13 +277,31 @@ class SimpleHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps({"files": files}).encode())
 
+    # ---- HEAD ----
+    def do_HEAD(self):
+        if self.path.startswith("/files/"):
+            return self._run_limited("files", lambda: self.handle_file_serve(head_only=True))
+        self.send_response(200)
+        self._send_cors_headers()
+        self.end_headers()
+
     # ---- GET Router ----
     def do_GET(self):
         if self.path.startswith("/files/"):
-            return self.handle_file_serve()
+            return self._run_limited("files", self.handle_file_serve)
 
         if self.path == "/uploaded-files":
-            return self.handle_uploads_get()
+            return self._run_limited("listing", self.handle_uploads_get)
+
+        if self.path.startswith("/ingest-jobs"):
+            return self._run_limited("listing", self.handle_ingest_job_get)
+
+        # Liveness: answered even while the chatbot is still loading
+        if self.path == "/health":
+            return self._send_json(200, {"status": "ok"})
+
+        if self.path == "/ready":
+            return self.handle_ready()
 
         # Fallback
         resp = b"<h1>Hello from Python HTTP Server!</h1>"
@@ -112,11 +315,26 @@ class SimpleHandler(BaseHTTPRequestHandler):
 
     # ---- POST Router ----
     def do_POST(self):
-        content_length = int(self.headers.get("Content-Length", 0))
+        # Streamed straight to disk; must not be read into memory here
+        if self.path == "/upload-stream":
+            return self._run_limited("upload", self.handle_upload_stream)
+
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            if content_length < 0:
+                raise ValueError(content_length)
+        except ValueError:
+            # Body length unknown, so the connection cannot be reused
+            self.close_connection = True
+            return self._send_json(400, {"error": "invalid Content-Length"})
+        if content_length > MAX_JSON_BYTES:
+            self.close_connection = True
+            return self._send_json(413, {"error": "request body too large"})
         body = self.rfile.read(content_length)
 
         try:
             data = json.loads(body)
+            del body
         except:
             self.send_response(400)
             self._send_cors_headers()
@@ -124,81 +342,305 @@ class SimpleHandler(BaseHTTPRequestHandler):
             self.wfile.write(b'{"error":"invalid JSON"}')
             return
 
-        print("POST data:", data)
-        content_type = self.headers.get("Content-Type", "")
-
         if self.path == "/upload-document":
-            print("Uploading a document...")
-
-            filename = data.get("filename")
-            dateOfCreation = data.get("dateOfCreation")
-            content_base64 = data.get("content")
-
-            # Normalize filename for macOS
-            raw_filename = self.path.replace("/files/", "")
-
-            # 1. URL-decode
-            decoded = raw_filename
+            return self._run_limited("upload", lambda: self.handle_upload(data))
 
-            # 2. Normalize to NFC (match macOS-friendly form)
-            safe_filename = unicodedata.normalize("NFC", decoded)
+        if self.path == "/chat-stream":
+            return self._run_limited("chat", lambda: self.handle_chat_stream(data))
 
-            print(f"Saving '{safe_filename}' created at {dateOfCreation}")
-
-            # Decode data
-            file_bytes = base64.b64decode(content_base64)
-
-            # Ensure upload directory exists
-            os.makedirs(UPLOAD_DIR, exist_ok=True)
+        # ---- Default POST behavior ----
+        return self._run_limited("chat", lambda: self.handle_chat(data))
 
-            # Save file
-            safe_filename = unicodedata.normalize("NFC", filename)
+    # ---- Upload a document (legacy base64 in JSON) ----
+    def handle_upload(self, data):
+        print("Uploading a document...")
 
-            # Always use the ABSOLUTE UPLOAD DIRECTORY
-            file_path = os.path.join(UPLOAD_DIR, safe_filename)
+        dateOfCreation = data.get("dateOfCreation")
+        safe_filename = safe_upload_name(data.get("filename"))
+        if safe_filename is None:
+            return self._send_json(400, {"error": "invalid filename"})
 
-            with open(file_path, "wb") as f:
-                f.write(file_bytes)
+        print(f"Saving '{safe_filename}' created at {dateOfCreation}")
 
-            document_data = load_document(file_path)
+        # Decode data
+        try:
+            file_bytes = base64.b64decode(data.get("content") or "")
+        except (binascii.Error, TypeError, ValueError):
+            return self._send_json(400, {"error": "content is not valid base64"})
+        data["content"] = None
 
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext == ".xlsx":
-                print("document_data ")
-                print(document_data)
-                chunks = document_data
+        try:
+            upload = receive_upload([file_bytes], safe_filename)
+        except UploadTooLarge as e:
+            return self._send_json(413, {"error": str(e)})
+        del file_bytes
+
+        self._enqueue_upload(upload)
+
+    # ---- Upload a document (streamed: multipart or raw body) ----
+    def handle_upload_stream(self):
+        """
+        Either multipart/form-data with a 'file' part (plus optional
+        'dateOfCreation'), or the raw file as the body with the name in the
+        X-Filename header (URL-encoded). Copied to disk in chunks, never held
+        in memory.
+        """
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.close_connection = True
+            return self._send_json(411, {"error": "Content-Length required"})
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self.close_connection = True
+            return self._send_json(400, {"error": "invalid Content-Length"})
+
+        content_type = self.headers.get_content_type()
+        multipart = content_type == "multipart/form-data"
+        # Multipart framing adds a little on top of the file itself
+        if length > MAX_UPLOAD_BYTES + (64 * 1024 if multipart else 0):
+            self.close_connection = True
+            return self._send_json(413, {"error": f"upload exceeds {MAX_UPLOAD_BYTES} bytes"})
+
+        body = iter_body(self.rfile, length)
+        try:
+            if multipart:
+                upload, dateOfCreation = self._receive_multipart(body)
             else:
-                chunks = chunk_document(document_data, safe_filename)
-            os.makedirs("./chunks", exist_ok=True)
-
-            save_chunks(chunks, "./chunks/" +safe_filename + "-chunks.json")
-            rag_chatbot.insert_chunks_into_table(chunks)
-
-            print(f"File saved to {file_path}")
-
-            self.send_response(200)
+                dateOfCreation = self.headers.get("X-Date-Of-Creation")
+                safe_filename = safe_upload_name(unquote(self.headers.get("X-Filename", "")))
+                if safe_filename is None:
+                    self.close_connection = True
+                    return self._send_json(400, {"error": "missing or invalid X-Filename"})
+                upload = receive_upload(body, safe_filename)
+        except UploadTooLarge as e:
+            self.close_connection = True
+            return self._send_json(413, {"error": str(e)})
+        except ValueError as e:
+            self.close_connection = True
+            return self._send_json(400, {"error": str(e)})
+
+        print(f"Received '{upload['filename']}' ({upload['size']} bytes, sha256 {upload['sha256'][:12]}) created at {dateOfCreation}")
+
+        self._enqueue_upload(upload)
+
+    def _receive_multipart(self, body):
+        boundary = self.headers.get_param("boundary")
+        if not boundary:
+            raise ValueError("multipart boundary missing")
+
+        upload = None
+        fields = {}
+        for headers, part in MultipartReader(body, boundary.encode("latin-1")).parts():
+            name = headers.get_param("name", header="content-disposition")
+            filename = headers.get_filename()
+            if filename is not None and upload is None:
+                safe_filename = safe_upload_name(filename)
+                if safe_filename is None:
+                    raise ValueError("invalid filename")
+                upload = receive_upload(part, safe_filename)
+            elif filename is None and name:
+                value = b"".join(part)
+                if len(value) > 64 * 1024:
+                    raise ValueError(f"form field '{name}' too large")
+                fields[name] = value.decode("utf-8", "replace")
+
+        if upload is None:
+            raise ValueError("no file part in upload")
+        return upload, fields.get("dateOfCreation")
+
+    def _enqueue_upload(self, upload):
+        """Queue a fully written upload for ingestion and answer 202 with the job."""
+        job = ingest_queue.submit(upload["path"], upload["filename"], upload["sha256"])
+        self._send_json(202, {
+            "status": "queued",
+            "job_id": job["job_id"],
+            "status_url": f"/ingest-jobs/{job['job_id']}",
+            "filename": upload["filename"],
+            "size": upload["size"],
+            "sha256": upload["sha256"],
+        })
+
+    # ---- Ingestion job status ----
+    def handle_ingest_job_get(self):
+        job_id = self.path.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+        if job_id == "ingest-jobs":
+            return self._send_json(200, {"jobs": ingest_queue.list(), "stats": ingest_queue.stats()})
+
+        job = ingest_queue.get(job_id)
+        if job is None:
+            return self._send_json(404, {"error": "unknown job"})
+        self._send_json(200, job)
+
+    # ---- Readiness ----
+    def handle_ready(self):
+        ready = chatbot_ready.is_set() and rag_chatbot is not None
+        payload = {
+            "ready": ready,
+            "components": rag_chatbot.readiness() if rag_chatbot is not None else {},
+            "ingest_jobs": ingest_queue.stats(),
+        }
+        if startup_error is not None:
+            payload["error"] = str(startup_error)
+        self._send_json(200 if ready else 503, payload)
+
+    def _require_chatbot(self):
+        """The chatbot, or None after answering 503 because it is not loaded yet."""
+        try:
+            return get_chatbot()
+        except ChatbotNotReady as e:
+            self.send_response(503)
             self._send_cors_headers()
             self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "5")
             self.end_headers()
-            self.wfile.write(b'{"status":"OK"}')
-            return
+            self.wfile.write(json.dumps({"error": f"chatbot not ready: {e}"}).encode())
+            return None
 
-        # ---- Default POST behavior ----
+    # ---- Chat ----
+    def handle_chat(self, data):
         message = data.get("message", "")
-        llm_response = rag_chatbot.return_response(message)
+        session_id = data.get("session_id") or self.headers.get("X-Session-Id")
+        rag_chatbot = self._require_chatbot()
+        if rag_chatbot is None:
+            return
+        llm_response = rag_chatbot.return_response(message, session_id)
         response = {"message": llm_response}
 
+        self._send_json(200, response)
+
+
+    # ---- Chat (Server-Sent Events) ----
+    def handle_chat_stream(self, data):
+        message = data.get("message", "")
+        session_id = data.get("session_id") or self.headers.get("X-Session-Id")
+        rag_chatbot = self._require_chatbot()
+        if rag_chatbot is None:
+            return
+
         self.send_response(200)
         self._send_cors_headers()
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
         self.end_headers()
-        self.wfile.write(json.dumps(response).encode())
+
+        events = rag_chatbot.stream_response(message, session_id)
+        try:
+            for event, payload in events:
+                self.wfile.write(
+                    f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+                )
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            print("Chat stream client disconnected")
+        except Exception as e:
+            print(f"Chat stream failed: {e}")
+            try:
+                self.wfile.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n".encode())
+            except OSError:
+                pass
+        finally:
+            # Releases the session lock if we stopped early
+            events.close()
+
+
+# ---- Background ingestion ----
+def ingest_document(job, report):
+    """Ingestion pipeline run by the job queue workers for one uploaded file."""
+    from file_chunkers import load_document, chunk_document, save_chunks
+
+    # Workers wait for startup instead of failing jobs queued during it
+    rag_chatbot = get_chatbot(timeout=None)
+    file_path = job["path"]
+    safe_filename = job["filename"]
+
+    document_data = load_document(file_path)
+    report("parsed")
+
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".xlsx":
+        chunks = document_data
+    else:
+        chunks = chunk_document(document_data, safe_filename)
+    if not chunks:
+        raise ValueError("no text could be extracted from the document")
+    os.makedirs("./chunks", exist_ok=True)
+    save_chunks(chunks, "./chunks/" +safe_filename + "-chunks.json")
+    report("chunked", chunks=len(chunks))
+
+    # Warms the embedding cache, so indexing below only diffs and writes
+    rag_chatbot.vectorize_texts([chunk["content"] for chunk in chunks])
+    report("embedded", chunks=len(chunks))
+
+    rag_chatbot.insert_chunks_into_table(chunks)
+    report("indexed", chunks=len(chunks))
+
+
+ingest_queue = IngestQueue(ingest_document)
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP server that hands connections to a bounded thread pool.
+    Once every worker is busy and the wait queue is full, new connections
+    get an immediate 503 instead of piling up behind slow LLM calls.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS, max_queued=MAX_QUEUED):
+        super().__init__(server_address, handler_class)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http-worker")
+        self.slots = threading.BoundedSemaphore(max_workers + max_queued)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        try:
+            self.pool.submit(self._process, request, client_address)
+        except RuntimeError:
+            # Pool already shut down
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        try:
+            # ThreadingMixIn helper: finish_request + error handling + close
+            self.process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+    def _reject(self, request):
+        try:
+            request.sendall(
+                b"HTTP/1.1 503 Service Unavailable\r\n"
+                b"Access-Control-Allow-Origin: *\r\n"
+                b"Retry-After: 1\r\n"
+                b"Content-Type: application/json\r\n"
+                + f"Content-Length: {len(BUSY_BODY)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + BUSY_BODY
+            )
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
 
 
 def main():
-    print("Starting server at http://localhost:8000")
-    server = HTTPServer(("0.0.0.0", 8000), SimpleHandler)
-    server.serve_forever()
+    print(f"Starting server at http://localhost:8000 ({MAX_WORKERS} workers, queue {MAX_QUEUED})")
+    server = PooledHTTPServer(("0.0.0.0", 8000), SimpleHandler)
+    threading.Thread(target=load_chatbot, name="chatbot-loader", daemon=True).start()
+    ingest_queue.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
 
 
 if __name__ == "__main__":
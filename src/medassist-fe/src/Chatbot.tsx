@@ -15,17 +15,43 @@ import { useMutation, useQueryClient } from "@tanstack/react-query";
 import toast from "react-hot-toast";
 import { UserProfile } from "./Profile";
 
+// crypto.randomUUID only exists in secure contexts (HTTPS/localhost);
+// the app is also served over plain HTTP, so fall back to getRandomValues
+function randomId(): string {
+  if (typeof crypto !== "undefined" && typeof crypto.randomUUID === "function") {
+    return crypto.randomUUID();
+  }
+  if (typeof crypto !== "undefined" && typeof crypto.getRandomValues === "function") {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, (b) => b.toString(16).padStart(2, "0")).join("");
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Stable id so the backend keeps this browser's conversation separate
+function getSessionId(): string {
+  let sessionId = localStorage.getItem("sessionId");
+  if (!sessionId) {
+    sessionId = randomId();
+    localStorage.setItem("sessionId", sessionId);
+  }
+  return sessionId;
+}
+
 export function useUploadDocument() {
   const queryClient = useQueryClient();
 
   return useMutation({
-    mutationFn: async (payload: any) => {
-      const res = await fetch("http://cuda1.ubmi.feec.vutbr.cz:8000/upload-document", {
+    mutationFn: async (file: File) => {
+      // Raw file as the body; the server streams it to disk
+      const res = await fetch("http://cuda1.ubmi.feec.vutbr.cz:8000/upload-stream", {
         method: "POST",
         headers: {
-          "Content-Type": "application/json",
+          "Content-Type": file.type || "application/octet-stream",
+          "X-Filename": encodeURIComponent(file.name),
+          "X-Date-Of-Creation": new Date().toISOString(),
         },
-        body: JSON.stringify(payload),
+        body: file,
       });
 
       if (!res.ok) {
@@ -57,34 +83,20 @@ function FileUpload() {
 
     setUploading(true);
 
-    const reader = new FileReader();
-
-    reader.onload = () => {
-      const base64 = reader.result.split(",")[1];
-
-      const payload = {
-        filename: file.name,
-        dateOfCreation: new Date().toISOString(),
-        content: base64,
-      };
-
-      uploadDocument.mutate(payload, {
-        onSuccess: () => {
-          setUploading(false);
-          setFile(null);
-          if (fileInputRef.current) {
-            fileInputRef.current.value = "";
-          }
-          toast.success("File uploaded successfully!");
-        },
-        onError: (err) => {
-          console.error(err);
-          setUploading(false);
-        },
-      });
-    };
-
-    reader.readAsDataURL(file);
+    uploadDocument.mutate(file, {
+      onSuccess: () => {
+        setUploading(false);
+        setFile(null);
+        if (fileInputRef.current) {
+          fileInputRef.current.value = "";
+        }
+        toast.success("File uploaded successfully!");
+      },
+      onError: (err) => {
+        console.error(err);
+        setUploading(false);
+      },
+    });
   };
 
   return (
@@ -337,7 +349,8 @@ const Chatbot: FC = () => {
         },
         body: JSON.stringify({
             message: fullPrompt,
-            context: currentContext
+            context: currentContext,
+            session_id: getSessionId()
         }),
       });
 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .retrieval import chunk_fingerprint
+
+# Opt-in: answers are reused across sessions, so it is off unless enabled
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "0") == "1"
+# Cosine similarity of (normalized) query vectors needed for a hit
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+
+
+def hits_key(hits: list[tuple[str, str]]) -> frozenset[tuple[str, str]]:
+    """Fingerprints of the retrieved chunks; any edit to one of them changes the key."""
+    return frozenset((filename, chunk_fingerprint(content)) for filename, content in hits)
+
+
+class AnswerCache:
+    """
+    Semantic cache of final answers to document questions.
+
+    An entry matches when the query vector is close enough to the cached
+    question's AND retrieval returned exactly the same chunks, so a paraphrase
+    reuses the answer while a changed document never does. Entries are also
+    dropped per file when ingestion rewrites that file.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_SIMILARITY, maxsize: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+
+        # key -> {"vector", "chunks", "files", "answer", "tokens", "seconds", "stored_at"}
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.saved_tokens = 0
+        self.saved_seconds = 0.0
+        self.hit_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        for key in [k for k, e in self._entries.items() if now - e["stored_at"] > self.ttl_seconds]:
+            del self._entries[key]
+
+    def get(self, query_vector, hits: list[tuple[str, str]]) -> dict | None:
+        """Cached entry for this question and these chunks, or None."""
+        started = time.perf_counter()
+        vector = np.asarray(query_vector, dtype=np.float32)
+        chunks = hits_key(hits)
+        with self._lock:
+            self.lookups += 1
+            self._expire(time.monotonic())
+
+            best_key, best_score = None, self.threshold
+            for key, entry in self._entries.items():
+                if entry["chunks"] != chunks:
+                    continue
+                score = float(np.dot(entry["vector"], vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.saved_tokens += entry["tokens"]
+            self.saved_seconds += entry["seconds"]
+            self.hit_seconds += time.perf_counter() - started
+            return {**entry, "similarity": best_score}
+
+    def put(self, query_vector, hits: list[tuple[str, str]], answer: str, tokens: int, seconds: float) -> None:
+        if not answer or not hits:
+            return
+        with self._lock:
+            self._entries[self._next_key] = {
+                "vector": np.asarray(query_vector, dtype=np.float32),
+                "chunks": hits_key(hits),
+                "files": {filename for filename, _ in hits},
+                "answer": answer,
+                "tokens": tokens,
+                "seconds": seconds,
+                "stored_at": time.monotonic(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_file(self, filename: str | None = None) -> int:
+        """Drop entries built on filename's chunks (all entries without a filename)."""
+        with self._lock:
+            if filename is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                return dropped
+            stale = [key for key, entry in self._entries.items() if filename in entry["files"]]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "saved_seconds": round(self.saved_seconds, 2),
+            "mean_hit_ms": round(1000 * self.hit_seconds / self.hits, 2) if self.hits else 0.0,
+        }
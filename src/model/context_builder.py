@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import os
+import re
+from collections import OrderedDict
+
+from .lexical_index import analyze
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts are estimated without it
+    tiktoken = None
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CHUNK_TOKENS = int(os.getenv("CONTEXT_CHUNK_TOKENS", "350"))
+# Chunks with fewer real words than this (TOC lines like "1. Účel 2") are dropped
+CONTEXT_MIN_WORDS = int(os.getenv("CONTEXT_MIN_WORDS", "6"))
+# Word-set overlap above which a chunk counts as a duplicate of a better one
+CONTEXT_DUPLICATE_OVERLAP = float(os.getenv("CONTEXT_DUPLICATE_OVERLAP", "0.8"))
+
+SENTENCE_SPLIT_REGEX = re.compile(r"(?<=[.!?;:])\s+(?=[A-ZÁČĎÉĚÍŇÓŘŠŤÚŮÝŽ0-9•\-–])|\n+")
+WORD_REGEX = re.compile(r"[^\W\d_]{2,}")
+
+
+class TokenCounter:
+    """tiktoken when installed, otherwise ~4 characters per token."""
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                print(f"tiktoken encoding '{encoding_name}' unavailable ({e}), estimating tokens.")
+
+    def __call__(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return (len(text) + 3) // 4
+
+
+count_tokens = TokenCounter()
+
+
+def _word_set(text: str) -> set[str]:
+    return set(analyze(" ".join(WORD_REGEX.findall(text))))
+
+
+class ContextBuilder:
+    """
+    Turns ranked (filename, content) hits into the context message.
+
+    Near-empty and duplicate chunks are dropped, long chunks are cut down to
+    the sentences that match the query (plus their neighbours), and the rest
+    is packed best-first into a token budget, grouped by source document.
+    """
+
+    def __init__(self, budget_tokens: int = CONTEXT_TOKEN_BUDGET, chunk_tokens: int = CONTEXT_CHUNK_TOKENS,
+                 min_words: int = CONTEXT_MIN_WORDS, duplicate_overlap: float = CONTEXT_DUPLICATE_OVERLAP):
+        self.budget_tokens = budget_tokens
+        self.chunk_tokens = chunk_tokens
+        self.min_words = min_words
+        self.duplicate_overlap = duplicate_overlap
+
+    # ---- filters ----
+
+    def _is_near_empty(self, content: str) -> bool:
+        return len(WORD_REGEX.findall(content or "")) < self.min_words
+
+    def _is_duplicate(self, words: set[str], kept: list[set[str]]) -> bool:
+        for other in kept:
+            smaller = min(len(words), len(other)) or 1
+            if len(words & other) / smaller >= self.duplicate_overlap:
+                return True
+        return False
+
+    # ---- trimming ----
+
+    def _trim(self, content: str, query_terms: set[str]) -> str:
+        """Keep the best matching sentences and their neighbours, in original order."""
+        content = re.sub(r"[ \t]+", " ", content).strip()
+        if count_tokens(content) <= self.chunk_tokens:
+            return content
+
+        sentences = [s.strip() for s in SENTENCE_SPLIT_REGEX.split(content) if s and s.strip()]
+        scores = [len(query_terms & set(analyze(s))) for s in sentences]
+        # Rank by matches; the chunk's opening sentence (usually its heading) wins ties
+        ranked = sorted(range(len(sentences)), key=lambda i: (-scores[i], i))
+
+        chosen, used = set(), 0
+        for i in ranked:
+            for j in (i, i - 1, i + 1):
+                if j in chosen or not 0 <= j < len(sentences):
+                    continue
+                cost = count_tokens(sentences[j])
+                if used + cost > self.chunk_tokens:
+                    continue
+                chosen.add(j)
+                used += cost
+            if used >= self.chunk_tokens or scores[i] == 0 and chosen:
+                break
+
+        if not chosen:
+            # A single sentence longer than the cap: hard cut
+            return content[: self.chunk_tokens * 4].rsplit(" ", 1)[0] + " …"
+
+        pieces, previous = [], None
+        for j in sorted(chosen):
+            if previous is not None and j != previous + 1:
+                pieces.append("…")
+            pieces.append(sentences[j])
+            previous = j
+        return " ".join(pieces)
+
+    # ---- assembly ----
+
+    def build(self, query: str, hits: list[tuple[str, str]]) -> tuple[str, dict]:
+        """Returns (context text, stats) for ranked hits, best first."""
+        query_terms = set(analyze(query))
+        stats = {
+            "candidates": len(hits),
+            "near_empty": 0,
+            "duplicates": 0,
+            "trimmed": 0,
+            "over_budget": 0,
+            "chunks": 0,
+            "documents": 0,
+            "tokens": 0,
+            "budget": self.budget_tokens,
+        }
+
+        by_document: "OrderedDict[str, list[str]]" = OrderedDict()
+        kept_words: list[set[str]] = []
+        used = 0
+        for filename, content in hits:
+            if self._is_near_empty(content):
+                stats["near_empty"] += 1
+                continue
+            words = _word_set(content)
+            if self._is_duplicate(words, kept_words):
+                stats["duplicates"] += 1
+                continue
+
+            excerpt = self._trim(content, query_terms)
+            if len(excerpt) < len(content.strip()):
+                stats["trimmed"] += 1
+            cost = count_tokens(excerpt)
+            if used + cost > self.budget_tokens:
+                stats["over_budget"] += 1
+                continue
+
+            kept_words.append(words)
+            by_document.setdefault(filename, []).append(excerpt)
+            used += cost
+
+        blocks = [
+            f"Text z dokumentu {filename} -> " + "\n\n".join(excerpts)
+            for filename, excerpts in by_document.items()
+        ]
+        text = "\n\n".join(blocks)
+        stats["chunks"] = sum(len(excerpts) for excerpts in by_document.values())
+        stats["documents"] = len(by_document)
+        stats["tokens"] = count_tokens(text)
+        return text, stats
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+import re
+
+from docx import Document
+from docx.oxml import OxmlElement
+
+PLACEHOLDER_REGEX = re.compile(r"\{\{[^{}]+\}\}")
+CHECKBOX_MARKERS = ("☐", "[ ]")
+
+
+# ------------- PARAGRAPH TEXT ------------- #
+
+def para_text(paragraph) -> str:
+    """Read paragraph text via run XML (avoids lxml XPath bug)."""
+    pieces: list[str] = []
+    for run in paragraph.runs:
+        r = run._r
+        for child in r:
+            tag = child.tag
+            if tag.endswith("}t") and child.text:
+                pieces.append(child.text)
+            elif tag.endswith("}tab"):
+                pieces.append("\t")
+            elif tag.endswith(("}br", "}cr")):
+                pieces.append("\n")
+    return "".join(pieces)
+
+
+def set_para_text(paragraph, new_text: str) -> None:
+    """Replace paragraph content with a single run containing new_text."""
+    p = paragraph._p
+    for child in list(p):
+        p.remove(child)
+
+    r = OxmlElement("w:r")
+    t = OxmlElement("w:t")
+    t.text = new_text
+    r.append(t)
+    p.append(r)
+
+
+def label_key(text: str) -> str:
+    """'  Jméno a příjmení: ' -> 'jméno a příjmení'"""
+    return text.strip().rstrip(":").strip().lower()
+
+
+def is_option(text: str) -> bool:
+    return any(marker in text for marker in CHECKBOX_MARKERS)
+
+
+def with_value(label: str, value: str) -> str:
+    base = label.rstrip()
+    sep = " " if base.endswith(":") else ": "
+    return base + sep + value
+
+
+class _Para:
+    """A paragraph together with its cached text and the text it had in the template."""
+
+    __slots__ = ("paragraph", "text", "original")
+
+    def __init__(self, paragraph):
+        self.paragraph = paragraph
+        self.text = para_text(paragraph)
+        self.original = self.text
+
+    def write(self, new_text: str):
+        set_para_text(self.paragraph, new_text)
+        self.text = new_text
+
+
+class _Cell:
+    __slots__ = ("cell", "paras", "original")
+
+    def __init__(self, cell):
+        self.cell = cell
+        self.paras = [_Para(p) for p in cell.paragraphs]
+        self.original = self.text
+
+    @property
+    def text(self) -> str:
+        return "\n".join(p.text for p in self.paras).strip()
+
+    def write(self, new_text: str):
+        if not self.paras:
+            self.paras = [_Para(self.cell.add_paragraph(""))]
+        for i, p in enumerate(self.paras):
+            p.write(new_text if i == 0 else "")
+
+
+class FormModel:
+    """
+    Parsed view of a Word form, built once per loaded template.
+
+    Indexes placeholders, labels (with the paragraph/cell their value goes
+    to) and checkbox groups, so each fill is a lookup plus a targeted write
+    instead of a scan of every paragraph and table cell.
+    """
+
+    def __init__(self, doc: Document):
+        self.doc = doc
+        self.paragraphs = [_Para(p) for p in doc.paragraphs]
+
+        # placeholder "{{X}}" -> paragraphs (body or cell) containing it
+        self.placeholders: dict[str, list[_Para]] = {}
+        # label key -> [(kind, label, target)] in document order
+        self.labels: dict[str, list[tuple]] = {}
+        # label key -> option paragraphs of the checkbox group below it
+        self.option_groups: dict[str, list[_Para]] = {}
+
+        self._index_paragraphs()
+        self._index_tables()
+
+    # ---- building ----
+
+    def _add_placeholders(self, para: _Para):
+        for placeholder in set(PLACEHOLDER_REGEX.findall(para.text)):
+            self.placeholders.setdefault(placeholder, []).append(para)
+
+    def _index_paragraphs(self):
+        paragraphs = self.paragraphs
+        next_group = self._option_groups_after()
+        for i, para in enumerate(paragraphs):
+            self._add_placeholders(para)
+
+            key = label_key(para.text)
+            if not key:
+                continue
+
+            # Value goes to the following empty paragraph, or inline after the label
+            if i + 1 < len(paragraphs) and not paragraphs[i + 1].text.strip():
+                target = ("next", para, paragraphs[i + 1])
+            else:
+                target = ("inline", para, para)
+            self.labels.setdefault(key, []).append(target)
+
+            # Option lines are members of a group, not labels of the next one
+            if next_group[i] and not is_option(para.text):
+                self.option_groups.setdefault(key, next_group[i])
+
+    def _option_groups_after(self) -> list[list[_Para]]:
+        """
+        For each paragraph, the first checkbox group below it. Blank lines and
+        instructions like '(vyberte)' between a label and its options are
+        skipped; once options start, the first blank or non-option line ends
+        the group.
+        """
+        paragraphs = self.paragraphs
+        following: list[list[_Para]] = [[] for _ in paragraphs]
+        group: list[_Para] = []
+        upcoming: list[_Para] = []
+        for i in range(len(paragraphs) - 1, -1, -1):
+            following[i] = upcoming
+            if is_option(paragraphs[i].text):
+                group.insert(0, paragraphs[i])
+                upcoming = group
+            else:
+                group = []
+        return following
+
+    def _index_tables(self):
+        cells_by_element = {}
+        for table in self.doc.tables:
+            for row in table.rows:
+                row_cells = []
+                for cell in row.cells:
+                    # Merged cells repeat the same element; share one entry
+                    entry = cells_by_element.get(id(cell._tc))
+                    if entry is None:
+                        entry = _Cell(cell)
+                        cells_by_element[id(cell._tc)] = entry
+                        for para in entry.paras:
+                            self._add_placeholders(para)
+                    row_cells.append(entry)
+
+                for c_idx, entry in enumerate(row_cells):
+                    key = label_key(entry.text)
+                    if not key:
+                        continue
+                    if c_idx + 1 < len(row_cells):
+                        target = ("cell", entry, row_cells[c_idx + 1])
+                    else:
+                        target = ("cell-inline", entry, entry)
+                    self.labels.setdefault(key, []).append(target)
+
+    # ---- lookups ----
+
+    def _find(self, index: dict, label: str) -> list:
+        """Exact label match first, then labels that contain the query."""
+        key = label_key(label)
+        if not key:
+            return []
+        if key in index:
+            return [index[key]]
+        return [value for indexed, value in index.items() if key in indexed]
+
+    # ---- writes ----
+
+    def replace_placeholder(self, placeholder: str, value: str) -> int:
+        """Replace placeholder everywhere it occurs, return number of replacements."""
+        total = 0
+        for para in self.placeholders.pop(placeholder, []):
+            count = para.text.count(placeholder)
+            if count:
+                para.write(para.text.replace(placeholder, value))
+                total += count
+        return total
+
+    def fill_by_label(self, field_label: str, value: str) -> bool:
+        """
+        Fill a value for a label. Re-filling the same label replaces the
+        previous value, because targets remember their template text.
+        """
+        updated = False
+        for targets in self._find(self.labels, field_label):
+            for kind, label, target in targets:
+                if kind == "next":
+                    target.write(value)
+                elif kind == "inline":
+                    target.write(with_value(label.original, value))
+                elif kind == "cell":
+                    target.write(value if not target.original else f"{target.original} {value}")
+                else:
+                    target.write(with_value(label.original, value))
+                updated = True
+        return updated
+
+    def select_option(self, field_label: str, option_text: str) -> bool:
+        """
+        Keep only the selected option of a checkbox group and clear the others.
+        The selected option is marked by replacing '☐' with '☒'.
+        """
+        option_norm = option_text.strip().lower()
+        groups = self._find(self.option_groups, field_label)
+        if not option_norm or not groups:
+            return False
+
+        options = groups[0]
+        if not any(option_norm in para.original.lower() for para in options):
+            return False
+
+        # Rewriting from the template text lets the user change their choice
+        for para in options:
+            original = para.original.strip()
+            if option_norm in original.lower():
+                para.write(original.replace("☐", "☒", 1).replace("[ ]", "[X]", 1))
+            else:
+                para.write("")
+        return True
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+
+from .template_catalog import fold_text
+
+# Section numbers ("4.4.13") stay one token; everything else splits on non-word chars
+TOKEN_REGEX = re.compile(r"\d+(?:\.\d+)+|\w+")
+
+
+# ------------- CZECH LIGHT STEMMER ------------- #
+# Suffix lists of the Dolamic & Savoy light stemmer (case endings, then
+# possessives), applied to diacritic-folded text. Folding makes 'č'/'c' and
+# 'š'/'s' indistinguishable, so the original palatalisation step would map
+# 'zadosti' and 'zadost' apart; endings are simply stripped instead.
+
+_CASE_SUFFIXES = (
+    # (min word length, suffixes), longest endings first
+    (8, ("atech",)),
+    (7, ("etem", "atum")),
+    (6, ("ech", "ich", "eho", "emi", "emu", "ete", "eti", "iho", "imi", "imu",
+         "ach", "ata", "aty", "ych", "ama", "ami", "ove", "ovi", "ymi")),
+    (5, ("em", "es", "im", "um", "at", "am", "os", "us", "ym", "mi", "ou")),
+    (4, ("e", "i", "u", "y", "a", "o")),
+)
+
+_POSSESSIVE_SUFFIXES = ("ov", "in", "uv")
+
+
+def stem_cs(word: str) -> str:
+    """'zadosti' -> 'zadost', 'oddeleni' -> 'oddelen'; short words and codes unchanged."""
+    if len(word) <= 3 or any(c.isdigit() for c in word):
+        return word
+
+    for min_len, suffixes in _CASE_SUFFIXES:
+        if len(word) >= min_len and word.endswith(suffixes):
+            word = word[: -len(next(s for s in suffixes if word.endswith(s)))]
+            break
+
+    if len(word) > 5 and word.endswith(_POSSESSIVE_SUFFIXES):
+        word = word[:-2]
+    return word
+
+
+def analyze(text: str) -> list[str]:
+    """Lowercase, strip diacritics, tokenize and stem."""
+    return [stem_cs(token) for token in TOKEN_REGEX.findall(fold_text(text or ""))]
+
+
+# ------------- BM25 ------------- #
+
+class BM25Index:
+    """
+    In-process inverted index over chunks, scored with Okapi BM25.
+
+    Chunks are grouped by file, and set_file() swaps one file's chunks in
+    place, so the index follows ingestion incrementally instead of being
+    rebuilt.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.docs: dict[int, dict] = {}
+        self.doc_lengths: dict[int, int] = {}
+        self.postings: dict[str, dict[int, int]] = defaultdict(dict)
+        self.files: dict[str, list[int]] = defaultdict(list)
+        self.total_length = 0
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ---- building ----
+
+    def _add(self, chunk: dict) -> None:
+        terms = Counter(analyze(chunk["content"]))
+        doc_id = self._next_id
+        self._next_id += 1
+
+        self.docs[doc_id] = {"id": chunk.get("id"), "filename": chunk["filename"], "content": chunk["content"]}
+        self.doc_lengths[doc_id] = sum(terms.values())
+        self.total_length += self.doc_lengths[doc_id]
+        self.files[chunk["filename"]].append(doc_id)
+        for term, tf in terms.items():
+            self.postings[term][doc_id] = tf
+
+    def _remove_file(self, filename: str) -> None:
+        for doc_id in self.files.pop(filename, []):
+            doc = self.docs.pop(doc_id)
+            self.total_length -= self.doc_lengths.pop(doc_id)
+            for term in set(analyze(doc["content"])):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def set_file(self, filename: str, chunks: list[dict]) -> None:
+        """Replace everything indexed for filename with chunks."""
+        with self._lock:
+            self._remove_file(filename)
+            for chunk in chunks:
+                if chunk.get("content"):
+                    self._add({**chunk, "filename": filename})
+
+    def add_chunks(self, chunks: list[dict]) -> None:
+        by_file = defaultdict(list)
+        for chunk in chunks:
+            by_file[chunk["filename"]].append(chunk)
+        for filename, file_chunks in by_file.items():
+            self.set_file(filename, file_chunks)
+
+    # ---- search ----
+
+    def search(self, query: str, top_k: int = 5) -> list[tuple[float, dict]]:
+        """Best matching chunks as (score, chunk), highest first."""
+        terms = set(analyze(query))
+        with self._lock:
+            n_docs = len(self.docs)
+            if not n_docs or not terms:
+                return []
+            avg_length = self.total_length / n_docs
+
+            scores = defaultdict(float)
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [(score, self.docs[doc_id]) for doc_id, score in best]
+
+    def stats(self) -> dict:
+        return {"chunks": len(self.docs), "files": len(self.files), "terms": len(self.postings)}
+
+
+def fuse_rankings(rankings: list[tuple[float, list]], top_k: int, rrf_k: int = 60) -> list:
+    """
+    Weighted reciprocal rank fusion of several ranked lists of hashable items.
+    Rank-based, so BM25 and cosine scores never need to share a scale.
+    """
+    fused = defaultdict(float)
+    for weight, ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] += weight / (rrf_k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:top_k]
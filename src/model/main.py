@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 import pandas as pd
-import iris
-from sentence_transformers import SentenceTransformer
 from langchain.agents import create_agent
 from langchain.agents.middleware import SummarizationMiddleware
 from langgraph.checkpoint.memory import InMemorySaver
@@ -13,15 +11,34 @@ from langchain.agents import create_agent
 from langchain.agents.middleware import SummarizationMiddleware
 from langgraph.checkpoint.memory import InMemorySaver
 from langchain_core.tools import tool
+from langchain_core.messages import AIMessage, HumanMessage
 from docx import Document
-from docx.oxml import OxmlElement
 from dotenv import load_dotenv
 
-import difflib
-import os
-
+# Before the local imports: iris_pool, embedding_model, embedding_cache and
+# upload_store read their settings at import time
 load_dotenv()
 
+from .session import SessionStore, active_session, DEFAULT_SESSION_ID
+from .ttl_cache import TTLCache
+from .retrieval import IrisBackend, InMemoryBackend
+from .form_model import FormModel, para_text, set_para_text
+from .template_catalog import TemplateCatalog, fold_text
+from .lexical_index import BM25Index, fuse_rankings
+from .context_builder import ContextBuilder, count_tokens
+from .middleware import EphemeralContextMiddleware
+from .router import needs_retrieval, rewrite_query
+from .answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from embedding_cache import get_embedding_cache, normalize_text
+from iris_pool import get_iris_pool
+from embedding_model import get_embedding_service, embedding_model_loaded
+from upload_store import move_into_uploads
+
+import os
+import time
+from contextlib import contextmanager
+import threading
+
 api_key = os.getenv("API_KEY")
 
 from openai import OpenAI
@@ -31,91 +48,239 @@ client = OpenAI(
 )
 OPENAI_API_KEY = api_key
 
+DOC_FLUSH_INTERVAL_SECONDS = float(os.getenv("DOC_FLUSH_INTERVAL_SECONDS", "60"))
+TEMPLATE_MATCH_CUTOFF = float(os.getenv("TEMPLATE_MATCH_CUTOFF", "0.2"))
+# Hybrid retrieval: BM25 + vector results fused by rank; weight 0 disables BM25
+LEXICAL_WEIGHT = float(os.getenv("LEXICAL_WEIGHT", "1.0"))
+# Each side contributes this many times top_k candidates to the fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "3"))
+# Ranked chunks handed to the context builder, which then fits them to the budget
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+# Upper bound for k the agent may ask search_documents for
+MAX_SEARCH_K = int(os.getenv("MAX_SEARCH_K", "15"))
+# History size that triggers a summarization call
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "4000"))
+
+# Static instructions, passed once as the agent's system prompt
+SYSTEM_PROMPT = """ Základy: 1. Jsi užitečný asistent, chatbot fungující v nemocnici. 2. Tvým posláním je odpovídat na dotazy zaměstnanců týkající se jejich práce a provádět je organizační strukturou nemocnice a administrativními procesy. 3. Poskytuj odpovědi přesně podle interních dokumentů, které jsou dostupné prostřednictvím RAG (retrieved context). 4. Uživatel má být bezpečně a krok za krokem proveden procesem či postupem tak, aby splnil veškeré požadavky směrnic a nic nevynechal. Tvůj způsob práce: 1. Odpovídej v jazyku, jakým mluví uživatel. 2. Ptej se uživatele na jeden konkrétní krok procesu. Nikdy nepřeskakuj více kroků najednou. 3. Vysvětluj pouze to, co uživatel potřebuje vědět pro aktuální krok. 4. Pokud je dotaz faktický, vždy nejprve vyhledej informace v dokumentech RAG. 5. Neodpovídej věci, které nejsou v podkladech, raději uveď, že nejsou uvedeny, nebo navrhni, kde se hledají. 6. Pokud uživatel neví, co má dělat, navrhni další krok. 7. Vyhýbej se nepodloženému nebo podlézavému lichocení. 8. Zachovej profesionalitu a střízlivou upřímnost. Co nesmíš dělat: 1. Nevymýšlej si pravidla, která nejsou ve zdrojových dokumentech. 2. Nevytvářej interní postupy, pokud nejsou výslovně uvedené. 3. Nehádej hodnoty (např. sazby stravného). Práce s dokumenty: - Pokud chce uživatel vyplnit formulář/dokument: 1. Rozhodni se, který z dostupných dokumentů a formulářů potřebuje. 2. Zavolej nástroj 'load_word_document' a jako argument použij: - buď přesný název souboru (např. 'Formular_XY.docx'), - nebo slovní popis (např. 'žádost o dovolenou', 'stížnost na dokumentaci'). 3. Pokud potřebuješ znát strukturu, použij 'show_current_document'. 4. U každé kategorie údajů (např. údaje o cestě či způsob dopravy) si vyžádej údaje o všech podúdajích od uživatele a použij nástroj 'fill_placeholder' s názvem pole nebo textovým štítkem (bez složených závorek) a hodnotou. Máš-li hodnot více najednou, vyplň je jedním voláním nástroje 'fill_fields'. 5. Pokud šablona obsahuje zástupné texty ve tvaru {{NAZEV_POLE}}, předávej do 'fill_placeholder' právě tento název pole. 6. Pokud formulář obsahuje pouze textové štítky jako 'Jméno a příjmení:' nebo 'Datum a čas odjezdu:', předávej tyto štítky (ideálně včetně dvojtečky) jako argument 'field_name' do nástroje 'fill_placeholder' - nástroj se pokusí doplnit hodnotu do řádku pod nebo do buňky vpravo (např. v tabulce 'Odhadované náklady'). 7. Pokud je v šabloně sekce se seznamem voleb (např. 'Způsob dopravy' s několika checkboxy), použij nástroj 'choose_option' s názvem sekce (např. 'Způsob dopravy') a textem vybrané možnosti (např. 'Soukromé vozidlo'). Nástroj nechá jen zvolenou možnost a ostatní odstraní. 8. Po dokončení použij 'save_document_as' a pojmenuj soubor podle kontextu. Originální šablona se nesmí přepsat. 9. Pokud uživatel upraví nějaké údaje, vymaž předchozí údaje a nahraď je novými. Pokud se uživatel dotazuje na nějaký proces v nemocnici (např. "Chci si stěžovat na nedostatečnou dokumentaci k webové aplikaci vyvinuté v Centru Informatiky (CI)"), 1. Odpovídej jasně a požádej uživatele o upřesnění, pokud nemůžeš přesně určit proces, který je pro uživatele relevantní (v tomto případě proces dokumentace ze strany oddělení nezdravotnických aplikací, které je součástí CI). 2. Pokud má uživatel podle předpisů více možností, jak dosáhnout svého cíle, popiš dostupné možnosti a zeptej se uživatele, kterou si chce vybrat。 - Pokud musí kontaktovat jiného zaměstnance, ale nemáš jeho kontaktní údaje, jasně mu sděl, že je nemáš. - Pokud musí kontaktovat jiného zaměstnance a ty máš jeho kontaktní údaje, poskytni mu tyto informace (jméno, telefonní číslo, e-mail). 3. Při odpovídání vždy upřednostňuj organizační informace z dodaných dokumentů. Pokud tam informace není dostupná, informuj o tom uživatele a nic si nevymýšlej. 4. Pokud nemáš informace o uživatelově dotazu nebo o tom, jak by měl uživatel v daném procesu postupovat, ale máš informace o tom, kde může uživatel získat kvalifikovanou pomoc, doporuč mu osoby, které má kontaktovat, a poskytni kontaktní informace (v tomto případě by měl uživatel kontaktovat oddělení nezdravotnických aplikací). 5. Na konci své odpovědi odkazuj k dokumentům (text "Text z dokumentu XYZ.docx", před ->), ze kterých jsi čerpal informace, pokud jsou relevantní. Vypiš je na konci odpovědi ve formátu: "Dále se můžete obrátit na dokument XYZ". 6. Pokud uživatel poprosí o pomoc s procesem, proveď ho několika kroky, které musí podniknout, aby dosáhl svého cíle. 7. Pokud dodaný kontext chybí nebo nestačí, použij nástroj 'search_documents' se samostatně srozumitelným dotazem (včetně zkratek oddělení a čísel kapitol) a případně vyšším 'k'. """
+SYSTEM_PROMPT_TOKENS = count_tokens(SYSTEM_PROMPT)
+
+
 class RAGChatbot:
     def __init__(self):
 
         # Directory with .docx templates
         self.doc_root = os.getenv("DATA_PATH")
 
-        self.current_doc: Document | None = None
-        self.current_doc_path: str | None = None
-        self.current_doc_name: str | None = None
-
-        conn = iris.connect("localhost", 32782, "DEMO", "_SYSTEM", "ISCDEMO")
-        self.cursor = conn.cursor()
-
-        self.embedding_model = self.get_embedding_model()
-        self.agent = self.create_chatbot()
-        self.config = {"configurable": {"thread_id": "1"}}
         self.table_name = "VectorSearch.ORGstruct"
+        self.embedding_service = get_embedding_service()
+        self.embedding_cache = get_embedding_cache(self.embedding_service.cache_name)
+        self.retrieval_backend = os.getenv("RETRIEVAL_BACKEND", "iris")
+        # Built on first use (see the properties below), so construction is cheap
+        self._retriever = None
+        self._agent = None
+        self._lexical_index = None
+        self._init_lock = threading.RLock()
+        self.template_catalog = TemplateCatalog(self.doc_root, encode_fn=self.vectorize_texts)
+        self.context_builder = ContextBuilder()
+        # How often the pre-router let a turn retrieve, by reason
+        self.route_counts: dict[str, int] = {}
+
+        # Repeated questions skip the model (query vectors) and IRIS (results).
+        # Results are keyed by index generation, bumped on every insert.
+        cache_ttl = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "900"))
+        self.query_vector_cache = TTLCache(maxsize=4096, ttl_seconds=cache_ttl)
+        self.search_result_cache = TTLCache(maxsize=1024, ttl_seconds=cache_ttl)
+        self.index_generation = 0
+        # Final answers reused for near-identical questions over identical chunks
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+        self.checkpointer = InMemorySaver()
+        self.sessions = SessionStore(
+            self.checkpointer,
+            max_sessions=int(os.getenv("MAX_SESSIONS", "200")),
+            ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", "3600")),
+            max_checkpoint_bytes=int(os.getenv("MAX_CHECKPOINT_MB", "256")) * 1024 * 1024,
+        )
 
-    # ------------- MODELS / VECTOR SEARCH ------------- #
-
-    def get_embedding_model(self):
-        return SentenceTransformer("all-MiniLM-L6-v2")
+    # ------------- LAZY COMPONENTS ------------- #
+
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            with self._init_lock:
+                if self._retriever is None:
+                    self._retriever = self.create_retriever(self.retrieval_backend)
+        return self._retriever
+
+    @property
+    def agent(self):
+        if self._agent is None:
+            with self._init_lock:
+                if self._agent is None:
+                    self._agent = self.create_chatbot()
+        return self._agent
+
+    @property
+    def lexical_index(self) -> BM25Index:
+        """BM25 over the stored chunks; built from the backend once, then kept in sync by inserts."""
+        if self._lexical_index is None:
+            with self._init_lock:
+                if self._lexical_index is None:
+                    started = time.perf_counter()
+                    index = BM25Index()
+                    index.add_chunks(self.retriever.all_chunks())
+                    print(f"Lexical index built: {index.stats()} in {time.perf_counter() - started:.2f}s")
+                    self._lexical_index = index
+        return self._lexical_index
+
+    def warm_up(self):
+        """Load the embedding model; IRIS and the agent stay lazy."""
+        self.embedding_service.model
+
+    def readiness(self) -> dict:
+        """Which components are loaded, for the /ready endpoint."""
+        components = {
+            "embedding_model": embedding_model_loaded(),
+            "embedding_service": self.embedding_service.stats(),
+            "retriever": self._retriever is not None,
+            "agent": self._agent is not None,
+            "lexical_index": self._lexical_index.stats() if self._lexical_index is not None else False,
+            "routes": dict(self.route_counts),
+            "sessions": self.sessions.stats(),
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else False,
+        }
+        if self.retrieval_backend != "memory":
+            components["iris_pool"] = get_iris_pool().stats()
+        return components
+
+    # ------------- SESSION STATE ------------- #
+
+    @property
+    def session(self):
+        """Session of the running request; the shared default one otherwise."""
+        session = active_session.get()
+        if session is None:
+            session = self.sessions.get(DEFAULT_SESSION_ID)
+        return session
+
+    @property
+    def config(self):
+        return self.session.config
+
+    @property
+    def current_doc(self) -> Document | None:
+        return self.session.current_doc
+
+    @current_doc.setter
+    def current_doc(self, value: Document | None):
+        self.session.current_doc = value
+
+    @property
+    def current_doc_path(self) -> str | None:
+        return self.session.current_doc_path
+
+    @current_doc_path.setter
+    def current_doc_path(self, value: str | None):
+        self.session.current_doc_path = value
+
+    @property
+    def current_doc_name(self) -> str | None:
+        return self.session.current_doc_name
+
+    @current_doc_name.setter
+    def current_doc_name(self, value: str | None):
+        self.session.current_doc_name = value
+
+    @property
+    def current_form(self) -> FormModel | None:
+        """Index of the current document, rebuilt if the document was swapped."""
+        session = self.session
+        if session.current_doc is None:
+            return None
+        if session.current_form is None or session.current_form.doc is not session.current_doc:
+            session.current_form = FormModel(session.current_doc)
+        return session.current_form
 
-    def vector_search(self, user_prompt: str):
-        search_vector = self.embedding_model.encode(
-            user_prompt,
-            normalize_embeddings=False,
-            show_progress_bar=False,
-        ).tolist()
+    # ------------- MODELS / VECTOR SEARCH ------------- #
 
-        search_sql = """
-            SELECT TOP 5 filename, content
-            FROM VectorSearch.ORGstruct
-            ORDER BY VECTOR_COSINE(vector, TO_VECTOR(?,DOUBLE)) DESC
+    def create_retriever(self, backend: str):
+        """
+        'iris'   - VECTOR_COSINE search in the IRIS container (default)
+        'memory' - in-process matrix built from the chunk JSON files
         """
-        self.cursor.execute(search_sql, [str(search_vector)])
-        results = self.cursor.fetchall()
-        return [f"Text z dokumentu {x} -> {y}" for x, y in results]
+        if backend == "memory":
+            retriever = InMemoryBackend(
+                dim=self.embedding_service.dimension,
+                quantize=os.getenv("MEMORY_INDEX_INT8", "0") == "1",
+                use_ann=os.getenv("MEMORY_INDEX_HNSW", "0") == "1",
+            )
+            retriever.load_chunks_dir(os.getenv("CHUNKS_DIR", "./chunks"), self.vectorize_texts)
+            return retriever
+
+        # Shared with db_insertion; requests each borrow their own connection
+        return IrisBackend(get_iris_pool(), self.table_name)
+
+    def encode_query(self, user_prompt: str) -> list[float]:
+        key = normalize_text(user_prompt)
+        search_vector = self.query_vector_cache.get(key)
+        if search_vector is None:
+            # Concurrent chat requests share one forward pass
+            search_vector = self.embedding_service.encode_query(user_prompt).tolist()
+            self.query_vector_cache.put(key, search_vector)
+        return search_vector
+
+    def vector_search(self, user_prompt: str, top_k: int = 5):
+        return [f"Text z dokumentu {x} -> {y}" for x, y in self.retrieve(user_prompt, top_k)]
+
+    def retrieve(self, user_prompt: str, top_k: int = 5) -> list[tuple[str, str]]:
+        """Ranked (filename, content) hits, cached until the index changes."""
+        generation = self.index_generation
+        cache_key = (generation, normalize_text(user_prompt), top_k)
+        cached = self.search_result_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        results = [tuple(hit) for hit in self.search_chunks(user_prompt, top_k)]
+        self.search_result_cache.put(cache_key, tuple(results))
+        return results
+
+    def search_chunks(self, user_prompt: str, top_k: int = 5) -> list[tuple[str, str]]:
+        """
+        Vector and BM25 candidates fused into one ranking. BM25 catches exact
+        tokens the embedding misses: department codes, section numbers, form names.
+        """
+        search_vector = self.encode_query(user_prompt)
+        if LEXICAL_WEIGHT <= 0:
+            return self.retriever.search(search_vector, top_k)
+
+        n_candidates = top_k * HYBRID_CANDIDATES
+        vector_hits = [tuple(hit) for hit in self.retriever.search(search_vector, n_candidates)]
+        lexical_hits = [
+            (chunk["filename"], chunk["content"])
+            for _, chunk in self.lexical_index.search(user_prompt, n_candidates)
+        ]
+        return fuse_rankings([(1.0, vector_hits), (LEXICAL_WEIGHT, lexical_hits)], top_k)
+
+    def invalidate_search_cache(self, filename: str | None = None):
+        """New rows can change any ranking, so every cached result is dropped."""
+        self.index_generation += 1
+        self.search_result_cache.clear()
+        if self.answer_cache is not None:
+            # Entries of other files keep matching only while their chunks do
+            self.answer_cache.invalidate_file(filename)
+        if filename:
+            print(f"Search cache invalidated after writing '{filename}'")
 
     # ------------- WORD DOCUMENT HELPERS ------------- #
 
     @staticmethod
     def _para_text(paragraph) -> str:
         """Read paragraph text via run XML (avoids lxml XPath bug)."""
-        pieces: list[str] = []
-        for run in paragraph.runs:
-            r = run._r
-            for child in r:
-                tag = child.tag
-                if tag.endswith("}t") and child.text:
-                    pieces.append(child.text)
-                elif tag.endswith("}tab"):
-                    pieces.append("\t")
-                elif tag.endswith(("}br", "}cr")):
-                    pieces.append("\n")
-        return "".join(pieces)
+        return para_text(paragraph)
 
     def _set_para_text(self, paragraph, new_text: str) -> None:
         """Replace paragraph content with a single run containing new_text."""
-        p = paragraph._p
-        for child in list(p):
-            p.remove(child)
-
-        r = OxmlElement("w:r")
-        t = OxmlElement("w:t")
-        t.text = new_text
-        r.append(t)
-        p.append(r)
-
-    def _cell_text(self, cell) -> str:
-        """Concatenate visible text of all paragraphs in a cell."""
-        return "\n".join(self._para_text(p) for p in cell.paragraphs).strip()
-
-    def _set_cell_text(self, cell, new_text: str) -> None:
-        """Overwrite a cell with a single paragraph containing new_text."""
-        if not cell.paragraphs:
-            p = cell.add_paragraph("")
-            self._set_para_text(p, new_text)
-            return
-
-        for i, p in enumerate(cell.paragraphs):
-            if i == 0:
-                self._set_para_text(p, new_text)
-            else:
-                self._set_para_text(p, "")
+        set_para_text(paragraph, new_text)
 
     def _doc_to_text(self, doc: Document, max_chars: int = 4000) -> str:
         """Plain text view of a document, truncated if needed."""
@@ -127,14 +292,7 @@ class RAGChatbot:
         return text
 
     def _list_docx_files(self):
-        if not os.path.isdir(self.doc_root):
-            return []
-        return [
-            f
-            for f in os.listdir(self.doc_root)
-            if f.lower().endswith(".docx")
-            and os.path.isfile(os.path.join(self.doc_root, f))
-        ]
+        return self.template_catalog.names()
 
     @staticmethod
     def _make_working_filename(filename: str) -> str:
@@ -143,147 +301,27 @@ class RAGChatbot:
         uid = uuid.uuid4().hex[:8]
         return f"{base}_copy_{uid}{ext}"
 
-    def _replace_in_paragraph(self, paragraph, placeholder: str, value: str) -> int:
-        """Replace placeholder in one paragraph, return number of replacements."""
-        full_text = self._para_text(paragraph)
-        if placeholder not in full_text:
-            return 0
-
-        count = full_text.count(placeholder)
-        if count == 0:
-            return 0
-
-        new_text = full_text.replace(placeholder, value)
-        self._set_para_text(paragraph, new_text)
-        return count
-
-    def _replace_placeholder_in_doc(
-        self, doc: Document, placeholder: str, value: str
-    ) -> int:
-        """Replace placeholder in all paragraphs and table cells."""
-        total = 0
-
-        for paragraph in doc.paragraphs:
-            total += self._replace_in_paragraph(paragraph, placeholder, value)
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        total += self._replace_in_paragraph(
-                            paragraph, placeholder, value
-                        )
-
-        return total
-
-    def _fill_field_by_label(self, doc: Document, field_label: str, value: str) -> bool:
-        """Fill a value after a given label (paragraph or table cell)."""
-        label_norm = field_label.strip()
-        if not label_norm:
-            return False
-
-        def matches(text: str) -> bool:
-            t = text.strip()
-            if not t:
-                return False
-            low = t.lower()
-            if label_norm.lower() in low:
-                return True
-            if (label_norm + ":").lower() in low:
-                return True
-            return False
-
-        updated = False
-
-        # Paragraph labels
-        paragraphs = doc.paragraphs
-        for i, p in enumerate(paragraphs):
-            txt = self._para_text(p)
-            if matches(txt):
-                if i + 1 < len(paragraphs):
-                    next_txt = self._para_text(paragraphs[i + 1]).strip()
-                    if not next_txt:
-                        self._set_para_text(paragraphs[i + 1], value)
-                    else:
-                        base = txt.rstrip()
-                        sep = " " if base.endswith(":") else ": "
-                        self._set_para_text(p, base + sep + value)
-                else:
-                    base = txt.rstrip()
-                    sep = " " if base.endswith(":") else ": "
-                    self._set_para_text(p, base + sep + value)
-                updated = True
-
-        # Table labels
-        for table in doc.tables:
-            for row in table.rows:
-                for c_idx, cell in enumerate(row.cells):
-                    cell_txt = self._cell_text(cell)
-                    if matches(cell_txt):
-                        if c_idx + 1 < len(row.cells):
-                            target_cell = row.cells[c_idx + 1]
-                            current = self._cell_text(target_cell)
-                            self._set_cell_text(
-                                target_cell,
-                                value if not current else f"{current} {value}",
-                            )
-                        else:
-                            base = cell_txt.rstrip()
-                            sep = " " if base.endswith(":") else ": "
-                            self._set_cell_text(cell, base + sep + value)
-                        updated = True
-
-        return updated
-
-    def _select_option(self, doc: Document, field_label: str, option_text: str) -> bool:
-        """
-        In a 'select an option' block (e.g. under 'Způsob dopravy'),
-        keep only the selected option and clear the others.
-        Selected option is visually marked by replacing '☐' with '☒'.
-        """
-        label_norm = field_label.strip().lower()
-        option_norm = option_text.strip().lower()
-        if not label_norm or not option_norm:
-            return False
-
-        updated = False
-        paragraphs = doc.paragraphs
-
-        for i, p in enumerate(paragraphs):
-            txt = self._para_text(p)
-            if label_norm in txt.lower():
-                # We found the "group" label. Now scan following paragraphs for options.
-                options_started = False
-                for j in range(i + 1, len(paragraphs)):
-                    opt_par = paragraphs[j]
-                    opt_txt = self._para_text(opt_par)
-                    stripped = opt_txt.strip()
-
-                    # Stop when we hit a blank line after options started
-                    if not stripped and options_started:
-                        break
-
-                    # Look for lines with checkbox-like markers
-                    if "☐" in stripped or "[ ]" in stripped:
-                        options_started = True
-                        # Decide if this paragraph is the selected one
-                        if option_norm in stripped.lower():
-                            # Mark as selected
-                            new_txt = stripped.replace("☐", "☒", 1)
-                            new_txt = new_txt.replace("[ ]", "[X]", 1)
-                            self._set_para_text(opt_par, new_txt)
-                            updated = True
-                        else:
-                            # Clear other options
-                            self._set_para_text(opt_par, "")
-                    else:
-                        # If we've already passed some options and this line isn't one, end block
-                        if options_started:
-                            break
-                break
+    def _fill_field(self, field_name: str, value: str) -> str | None:
+        """Fill one field in memory; returns an error message if it was not found."""
+        form = self.current_form
+        placeholder = f"{{{{{field_name}}}}}"
+        replaced_count = form.replace_placeholder(placeholder, value)
+
+        if replaced_count == 0:
+            filled_by_label = form.fill_by_label(field_name, value)
+            if not filled_by_label:
+                return (
+                    f"Nepodařilo se najít ani placeholder '{placeholder}', "
+                    f"ani pole se štítkem odpovídajícím '{field_name}'. "
+                    "Zkontroluj prosím název pole."
+                )
 
-        return updated
-        return updated
+        self.session.mark_dirty()
+        return None
+
+    def flush_document(self, force: bool = False) -> bool:
+        """Write the current working document to disk if it has unsaved changes."""
+        return self.session.flush_document(force=force)
 
     def _find_best_matching_doc(self, query: str) -> tuple[str | None, str]:
         """Find the best matching .docx template name for the query."""
@@ -291,15 +329,15 @@ class RAGChatbot:
         if not files:
             return None, "V adresáři šablon nejsou žádné .docx soubory."
 
-        q = query.strip().lower()
+        q = fold_text(query.strip())
         if not q:
             return None, "Dotaz je prázdný."
 
         for f in files:
-            if f.lower() == q:
+            if fold_text(f) == q:
                 return f, f"Použit přesný název souboru '{f}'."
 
-        contains = [f for f in files if q in f.lower()]
+        contains = [f for f in files if q in fold_text(f)]
         if len(contains) == 1:
             return contains[0], f"Nalezeno podle podřetězce v názvu souboru '{contains[0]}'."
         if len(contains) > 1:
@@ -310,7 +348,9 @@ class RAGChatbot:
                 f"Další možné: {alts}"
             )
 
-        matches = difflib.get_close_matches(q, files, n=3, cutoff=0.3)
+        # Fuzzy/semantic match on name, title, field labels and template text
+        ranked = self.template_catalog.rank(query, self.encode_query(query))
+        matches = [f for score, f in ranked if score >= TEMPLATE_MATCH_CUTOFF]
         if not matches:
             available = ", ".join(files)
             return None, (
@@ -326,60 +366,52 @@ class RAGChatbot:
             f"Dokument nejlépe odpovídající popisu: '{main}'. "
             f"Další kandidáti: {alts}"
         )
-    def create_table(self):
-        create_table_query = f"""
-        CREATE TABLE IF NOT EXISTS {self.table_name} (
-        id INTEGER,
-        filename LONGVARCHAR,
-        content LONGVARCHAR,
-        vector VECTOR(DOUBLE, 384)
-        )
-        """
-        self.cursor.execute(create_table_query)
-        # self.conn.commit()
-        # self.conn.close()
+    def vectorize_texts(self, texts: list[str]):
+        # Only texts missing from the shared cache reach the model
+        return self.embedding_cache.encode(texts, self.embedding_service.encode)
     def vectorize_content(self, df):
-        embeddings = self.get_embedding_model().encode(df['content'], normalize_embeddings=True, show_progress_bar=True)
-        return embeddings
+        return self.vectorize_texts(df['content'].tolist())
     def vectorize_filename(self, df):
-        embeddings = self.get_embedding_model().encode(df['filename'], normalize_embeddings=True, show_progress_bar=True)
-        return embeddings
-    def insert_chunks_into_table(self, chunks: pd.DataFrame):
-        chunks = pd.DataFrame(chunks)
-        self.create_table()
-        embeddings = self.vectorize_content(chunks)
-        chunks["vector"] = embeddings.tolist()
-        # IMPORTANT: convert vector (list) → string
-        chunks["vector"] = chunks["vector"].apply(lambda v: str(v))
-        insert_query = f"""
-        INSERT INTO {self.table_name} (id, filename, content, vector)
-        VALUES (?, ?, ?, TO_VECTOR(?))
+        return self.embedding_service.encode(df['filename'].tolist())
+    def insert_chunks_into_table(self, chunks: pd.DataFrame, incremental: bool | None = None):
         """
-        rows_list = chunks[["id", "filename", "content", "vector"]].values.tolist()
-        self.cursor.executemany(insert_query, rows_list)
-        # self.conn.commit()
-        # self.conn.close()
-        print("Insertions done!")
-
-    def _find_uploads_dir(self) -> str:
+        Store chunks of one or more files. In incremental mode (default, see
+        INCREMENTAL_INGEST) each file's stored chunks are diffed against the new
+        ones and only inserted/changed/removed chunks are written.
         """
-        Locate an existing 'uploads' directory anywhere under the current
-        working directory. If none is found, create one under doc_root.
-        """
-        base_dir = os.getcwd()
-        for root, dirs, _ in os.walk(base_dir):
-            for d in dirs:
-                if d.lower() == "uploads":
-                    return os.path.join(root, d)
+        if incremental is None:
+            incremental = os.getenv("INCREMENTAL_INGEST", "1") == "1"
+        chunks = pd.DataFrame(chunks)
 
-        default_dir = os.path.join(self.doc_root, "uploads")
-        os.makedirs(default_dir, exist_ok=True)
-        return default_dir
+        if incremental:
+            for filename, group in chunks.groupby("filename", sort=False):
+                records = group[["id", "filename", "content"]].to_dict("records")
+                stats = self.retriever.sync_file(filename, records, self.vectorize_texts)
+                print(f"Synced '{filename}': {stats}")
+                if stats["updated"] or stats["inserted"] or stats["deleted"]:
+                    self._sync_lexical_index(filename, records)
+                    self.invalidate_search_cache(filename)
+        else:
+            embeddings = self.vectorize_content(chunks)
+            records = chunks[["id", "filename", "content"]].to_dict("records")
+            self.retriever.add_chunks(records, embeddings)
+            for filename, group in chunks.groupby("filename", sort=False):
+                self._sync_lexical_index(filename, group[["id", "filename", "content"]].to_dict("records"))
+                self.invalidate_search_cache(filename)
+        print(f"Insertions done! Embedding cache: {self.embedding_cache.stats()}")
+
+    def _sync_lexical_index(self, filename: str, records: list[dict]):
+        # Waits for a build in progress; if none was built yet, the first
+        # search reads these rows from the backend anyway
+        with self._init_lock:
+            index = self._lexical_index
+        if index is not None:
+            index.set_file(filename, records)
 
     # ------------- AGENT / TOOLS ------------- #
 
     def create_chatbot(self):
-        checkpointer = InMemorySaver()
+        checkpointer = self.checkpointer
 
         llm = ChatOpenAI(
             model="gpt-5.1",
@@ -387,6 +419,19 @@ class RAGChatbot:
             api_key=OPENAI_API_KEY,
         )
 
+        @tool
+        def search_documents(query: str, k: int = 5) -> str:
+            """
+            Search the hospital's internal documents. Pass a standalone query
+            (resolve 'it'/'that' from the conversation, keep department codes and
+            section numbers); raise k (max 15) when the first results were not enough.
+            """
+            k = max(1, min(int(k), MAX_SEARCH_K))
+            search_query = rewrite_query(query)
+            context, stats = self.context_builder.build(search_query, self.retrieve(search_query, k))
+            print(f"search_documents('{search_query}', k={k}): {stats['chunks']} chunks, {stats['tokens']} tokens")
+            return context or "V dokumentech nebylo nic nalezeno."
+
         @tool
         def load_word_document(query: str) -> str:
             """Load a template by name/description and create a working copy."""
@@ -394,20 +439,21 @@ class RAGChatbot:
             if not filename:
                 return info
 
-            template_path = os.path.join(self.doc_root, filename)
             try:
-                template_doc = Document(template_path)
+                # The working copy lives in memory; it is written on the first flush
+                doc = self.template_catalog.get(filename).open()
             except Exception as e:
                 return f"Dokument '{filename}' se nepodařilo načíst: {e}"
 
             working_filename = self._make_working_filename(filename)
             working_path = os.path.join(self.doc_root, working_filename)
-            template_doc.save(working_path)
 
-            doc = Document(working_path)
+            self.flush_document()
             self.current_doc = doc
+            self.session.current_form = FormModel(doc)
             self.current_doc_path = working_path
             self.current_doc_name = working_filename
+            self.session.mark_dirty()
 
             preview = self._doc_to_text(doc, max_chars=1500)
             return (
@@ -438,11 +484,13 @@ class RAGChatbot:
                 new_filename += ".docx"
 
             new_path = os.path.join(self.doc_root, new_filename)
-            self.current_doc.save(new_path)
+            # Filled forms are not templates
+            self.template_catalog.exclude(new_filename)
 
             # >>> This was missing – make the newly saved file the current one <<<
             self.current_doc_path = new_path
             self.current_doc_name = new_filename
+            self.flush_document(force=True)
 
             return (
                 f"Aktualizovaný dokument byl uložen jako '{new_filename}'. "
@@ -459,28 +507,37 @@ class RAGChatbot:
             if self.current_doc is None or self.current_doc_path is None:
                 return "Není načten žádný dokument. Použij nejdřív 'load_word_document'."
 
-            placeholder = f"{{{{{field_name}}}}}"
-            replaced_count = self._replace_placeholder_in_doc(
-                self.current_doc, placeholder, value
-            )
+            error = self._fill_field(field_name, value)
+            if error:
+                return error
 
-            if replaced_count == 0:
-                filled_by_label = self._fill_field_by_label(
-                    self.current_doc, field_name, value
-                )
-                if not filled_by_label:
-                    return (
-                        f"Nepodařilo se najít ani placeholder '{placeholder}', "
-                        f"ani pole se štítkem odpovídajícím '{field_name}'. "
-                        "Zkontroluj prosím název pole."
-                    )
-
-            self.current_doc.save(self.current_doc_path)
             return (
                 f"Pole '{field_name}' bylo vyplněno hodnotou '{value}'. "
-                f"Aktualizovaný dokument je uložen jako {self.current_doc_name}."
+                f"Změny v dokumentu {self.current_doc_name} se uloží při uložení či odeslání."
             )
 
+        @tool
+        def fill_fields(fields: dict[str, str]) -> str:
+            """
+            Fill many fields of the current document in one call.
+            `fields` maps field names/labels (as for 'fill_placeholder') to values.
+            """
+            if self.current_doc is None or self.current_doc_path is None:
+                return "Není načten žádný dokument. Použij nejdřív 'load_word_document'."
+
+            filled, errors = [], []
+            for field_name, value in fields.items():
+                error = self._fill_field(field_name, str(value))
+                if error:
+                    errors.append(error)
+                else:
+                    filled.append(field_name)
+
+            lines = []
+            if filled:
+                lines.append(f"Vyplněná pole: {', '.join(filled)}.")
+            lines.extend(errors)
+            return "\n".join(lines) or "Nebyla zadána žádná pole."
 
         @tool
         def choose_option(field_label: str, option_text: str) -> str:
@@ -488,18 +545,18 @@ class RAGChatbot:
             if self.current_doc is None or self.current_doc_path is None:
                 return "Není načten žádný dokument. Použij nejdřív 'load_word_document'."
 
-            changed = self._select_option(self.current_doc, field_label, option_text)
+            changed = self.current_form.select_option(field_label, option_text)
             if not changed:
                 return (
                     f"Nepodařilo se najít sekci '{field_label}' nebo možnost obsahující "
                     f"'{option_text}'. Zkontroluj prosím texty v šabloně."
                 )
 
-            self.current_doc.save(self.current_doc_path)
+            self.session.mark_dirty()
             return (
                 f"V sekci '{field_label}' byla vybrána možnost '{option_text}'. "
                 f"Ostatní možnosti byly odstraněny nebo vyprázdněny. "
-                f"Aktualizovaný dokument je uložen jako {self.current_doc_name}."
+                f"Změny v dokumentu {self.current_doc_name} se uloží při uložení či odeslání."
             )
 
         @tool
@@ -511,26 +568,13 @@ class RAGChatbot:
             if self.current_doc is None or self.current_doc_path is None:
                 return "Není načten žádný dokument. Použij nejdřív 'load_word_document'."
 
+            self.flush_document()
             if not os.path.isfile(self.current_doc_path):
                 return f"Soubor '{self.current_doc_path}' neexistuje na disku."
 
-            uploads_dir = self._find_uploads_dir()
-            filename = os.path.basename(self.current_doc_path)
-            dest_path = os.path.join(uploads_dir, filename)
-
-            if os.path.exists(dest_path):
-                base, ext = os.path.splitext(filename)
-                suffix = 1
-                while True:
-                    candidate = f"{base}_{suffix}{ext}"
-                    candidate_path = os.path.join(uploads_dir, candidate)
-                    if not os.path.exists(candidate_path):
-                        dest_path = candidate_path
-                        break
-                    suffix += 1
-
-            shutil.move(self.current_doc_path, dest_path)
+            dest_path = move_into_uploads(self.current_doc_path)
             self.current_doc_path = dest_path
+            self.current_doc_name = os.path.basename(dest_path)
 
             return (
                 "Dokument byl přesunut do složky 'uploads'. "
@@ -538,9 +582,11 @@ class RAGChatbot:
             )
 
         tools = [
+            search_documents,
             load_word_document,
             show_current_document,
             fill_placeholder,
+            fill_fields,
             choose_option,
             save_document_as,
             send_to_uploads,
@@ -549,12 +595,14 @@ class RAGChatbot:
         agent = create_agent(
             model=llm,
             tools=tools,
+            system_prompt=SYSTEM_PROMPT,
             middleware=[
                 SummarizationMiddleware(
                     model=llm,
-                    trigger=("tokens", 4000),
+                    trigger=("tokens", SUMMARY_TRIGGER_TOKENS),
                     keep=("messages", 20),
                 ),
+                EphemeralContextMiddleware(lambda: self.session.turn_context),
             ],
             checkpointer=checkpointer,
         )
@@ -568,25 +616,222 @@ class RAGChatbot:
     def validation(self, result):
         return result
 
-    def return_response(self, query):
-        results = self.vector_search(query)
-
-        system_prompt = """ Základy: 1. Jsi užitečný asistent, chatbot fungující v nemocnici. 2. Tvým posláním je odpovídat na dotazy zaměstnanců týkající se jejich práce a provádět je organizační strukturou nemocnice a administrativními procesy. 3. Poskytuj odpovědi přesně podle interních dokumentů, které jsou dostupné prostřednictvím RAG (retrieved context). 4. Uživatel má být bezpečně a krok za krokem proveden procesem či postupem tak, aby splnil veškeré požadavky směrnic a nic nevynechal. Tvůj způsob práce: 1. Odpovídej v jazyku, jakým mluví uživatel. 2. Ptej se uživatele na jeden konkrétní krok procesu. Nikdy nepřeskakuj více kroků najednou. 3. Vysvětluj pouze to, co uživatel potřebuje vědět pro aktuální krok. 4. Pokud je dotaz faktický, vždy nejprve vyhledej informace v dokumentech RAG. 5. Neodpovídej věci, které nejsou v podkladech, raději uveď, že nejsou uvedeny, nebo navrhni, kde se hledají. 6. Pokud uživatel neví, co má dělat, navrhni další krok. 7. Vyhýbej se nepodloženému nebo podlézavému lichocení. 8. Zachovej profesionalitu a střízlivou upřímnost. Co nesmíš dělat: 1. Nevymýšlej si pravidla, která nejsou ve zdrojových dokumentech. 2. Nevytvářej interní postupy, pokud nejsou výslovně uvedené. 3. Nehádej hodnoty (např. sazby stravného). Práce s dokumenty: - Pokud chce uživatel vyplnit formulář/dokument: 1. Rozhodni se, který z dostupných dokumentů a formulářů potřebuje. 2. Zavolej nástroj 'load_word_document' a jako argument použij: - buď přesný název souboru (např. 'Formular_XY.docx'), - nebo slovní popis (např. 'žádost o dovolenou', 'stížnost na dokumentaci'). 3. Pokud potřebuješ znát strukturu, použij 'show_current_document'. 4. U každé kategorie údajů (např. údaje o cestě či způsob dopravy) si vyžádej údaje o všech podúdajích od uživatele a použij nástroj 'fill_placeholder' s názvem pole nebo textovým štítkem (bez složených závorek) a hodnotou. 5. Pokud šablona obsahuje zástupné texty ve tvaru {{NAZEV_POLE}}, předávej do 'fill_placeholder' právě tento název pole. 6. Pokud formulář obsahuje pouze textové štítky jako 'Jméno a příjmení:' nebo 'Datum a čas odjezdu:', předávej tyto štítky (ideálně včetně dvojtečky) jako argument 'field_name' do nástroje 'fill_placeholder' - nástroj se pokusí doplnit hodnotu do řádku pod nebo do buňky vpravo (např. v tabulce 'Odhadované náklady'). 7. Pokud je v šabloně sekce se seznamem voleb (např. 'Způsob dopravy' s několika checkboxy), použij nástroj 'choose_option' s názvem sekce (např. 'Způsob dopravy') a textem vybrané možnosti (např. 'Soukromé vozidlo'). Nástroj nechá jen zvolenou možnost a ostatní odstraní. 8. Po dokončení použij 'save_document_as' a pojmenuj soubor podle kontextu. Originální šablona se nesmí přepsat. 9. Pokud uživatel upraví nějaké údaje, vymaž předchozí údaje a nahraď je novými. Pokud se uživatel dotazuje na nějaký proces v nemocnici (např. "Chci si stěžovat na nedostatečnou dokumentaci k webové aplikaci vyvinuté v Centru Informatiky (CI)"), 1. Odpovídej jasně a požádej uživatele o upřesnění, pokud nemůžeš přesně určit proces, který je pro uživatele relevantní (v tomto případě proces dokumentace ze strany oddělení nezdravotnických aplikací, které je součástí CI). 2. Pokud má uživatel podle předpisů více možností, jak dosáhnout svého cíle, popiš dostupné možnosti a zeptej se uživatele, kterou si chce vybrat。 - Pokud musí kontaktovat jiného zaměstnance, ale nemáš jeho kontaktní údaje, jasně mu sděl, že je nemáš. - Pokud musí kontaktovat jiného zaměstnance a ty máš jeho kontaktní údaje, poskytni mu tyto informace (jméno, telefonní číslo, e-mail). 3. Při odpovídání vždy upřednostňuj organizační informace z dodaných dokumentů. Pokud tam informace není dostupná, informuj o tom uživatele a nic si nevymýšlej. 4. Pokud nemáš informace o uživatelově dotazu nebo o tom, jak by měl uživatel v daném procesu postupovat, ale máš informace o tom, kde může uživatel získat kvalifikovanou pomoc, doporuč mu osoby, které má kontaktovat, a poskytni kontaktní informace (v tomto případě by měl uživatel kontaktovat oddělení nezdravotnických aplikací). 5. Na konci své odpovědi odkazuj k dokumentům (text "Text z dokumentu XYZ.docx", před ->), ze kterých jsi čerpal informace, pokud jsou relevantní. Vypiš je na konci odpovědi ve formátu: "Dále se můžete obrátit na dokument XYZ". 6. Pokud uživatel poprosí o pomoc s procesem, proveď ho několika kroky, které musí podniknout, aby dosáhl svého cíle. """
+    @contextmanager
+    def _session_scope(self, session_id: str | None):
+        """Run one agent turn exclusively inside the client's session."""
+        session = self.sessions.get(session_id)
+        with session.lock:
+            token = active_session.set(session)
+            try:
+                yield session
+            finally:
+                # Timed write-back for documents that are never saved explicitly
+                if session.doc_dirty and time.monotonic() - session.last_flush >= DOC_FLUSH_INTERVAL_SECONDS:
+                    session.flush_document()
+                session.turn_context = None
+                session.answer_key = None
+                active_session.reset(token)
+                session.touch()
+                self.sessions.enforce_memory_cap(session)
+
+    def return_response(self, query, session_id: str | None = None):
+        with self._session_scope(session_id):
+            return self._run_turn(query)
+
+    def stream_response(self, query, session_id: str | None = None):
+        """
+        Yield (event, data) pairs while the agent runs:
+          ("token", {"text"})          - model output as it is generated
+          ("tool_call", {"name", "args"}) - the model decided to call a tool
+          ("tool_result", {"name"})    - a tool finished
+          ("done", {"message"})        - final answer
+        """
+        with self._session_scope(session_id):
+            messages = self._build_messages(query)
+            started = time.perf_counter()
+            cached = self._cached_answer(query)
+            if cached is not None:
+                yield "token", {"text": cached}
+                yield "done", {
+                    "message": cached,
+                    "context": self.session.context_stats,
+                    "history_tokens": self.session.history_tokens,
+                }
+                return
+
+            final_text = ""
+            turn_messages = []
+            for mode, data in self.agent.stream(
+                {"messages": messages}, self.config, stream_mode=["messages", "updates"]
+            ):
+                if mode == "messages":
+                    chunk, metadata = data
+                    # Only the agent's own model node; summarization calls stay hidden
+                    if metadata.get("langgraph_node") != "model":
+                        continue
+                    text = self._message_text(chunk)
+                    if text:
+                        yield "token", {"text": text}
+                    continue
+
+                for node, update in (data or {}).items():
+                    for message in (update or {}).get("messages", []):
+                        turn_messages.append(message)
+                        if node == "model":
+                            for call in getattr(message, "tool_calls", None) or []:
+                                yield "tool_call", {"name": call["name"], "args": call["args"]}
+                            if not getattr(message, "tool_calls", None):
+                                final_text = self._message_text(message)
+                        elif node == "tools":
+                            yield "tool_result", {"name": getattr(message, "name", None)}
+
+            self._record_history_tokens()
+            seconds = time.perf_counter() - started
+            self._report_turn(seconds)
+            self._store_answer(final_text, turn_messages, seconds)
+            yield "done", {
+                "message": final_text,
+                "context": self.session.context_stats,
+                "history_tokens": self.session.history_tokens,
+            }
 
-        context_msg = ""
-        if results:
-            joined = "\n".join(results)
-            context_msg = (
-                "Následuje kontext z nemocničních dokumentů. Při odpovědi se drž těchto informací a na konci odpovědi odkaž na příslušné dokumenty.\n\n"
-                f"{joined}"
-            )
+    @staticmethod
+    def _message_text(message) -> str:
+        content = getattr(message, "content", "")
+        if isinstance(content, str):
+            return content
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
 
-        messages = [("system", system_prompt)]
-        if context_msg:
-            messages.append(("system", context_msg))
-        messages.append(("user", query))
+    def _run_turn(self, query):
+        messages = self._build_messages(query)
+        started = time.perf_counter()
+        cached = self._cached_answer(query)
+        if cached is not None:
+            return cached
 
         response = self.agent.invoke({"messages": messages}, self.config)
         validated_response = self.validation(response)
+        self._record_history_tokens()
+        seconds = time.perf_counter() - started
+        self._report_turn(seconds)
+
+        messages = validated_response["messages"]
+        self._store_answer(self._message_text(messages[-1]), self._current_turn(messages), seconds)
+        return messages[-1].content
+
+    @staticmethod
+    def _current_turn(messages) -> list:
+        """Messages the agent added after the latest user message."""
+        turn = []
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            turn.append(message)
+        return turn[::-1]
+
+    def _cached_answer(self, query) -> str | None:
+        """
+        Answer of an earlier near-identical question over the same chunks.
+        The exchange is still appended to the thread, so follow-ups read normally.
+        """
+        key = self.session.answer_key
+        if self.answer_cache is None or key is None:
+            return None
+        entry = self.answer_cache.get(*key)
+        if entry is None:
+            return None
+
+        self.agent.update_state(
+            self.config,
+            {"messages": [HumanMessage(content=query), AIMessage(content=entry["answer"])]},
+            as_node="model",
+        )
+        self._record_history_tokens()
+        self.session.context_stats = {**(self.session.context_stats or {}), "answer_cache": "hit"}
+        print(
+            f"Answer cache hit (similarity {entry['similarity']:.3f}): saved ~{entry['tokens']} tokens "
+            f"and {entry['seconds']:.2f}s; {self.answer_cache.stats()}"
+        )
+        return entry["answer"]
+
+    def _store_answer(self, answer: str, turn_messages: list, seconds: float):
+        """Cache a finished answer unless the turn touched documents through tools."""
+        key = self.session.answer_key
+        if self.answer_cache is None or key is None or self.current_doc is not None:
+            return
+        tokens = 0
+        for message in turn_messages:
+            for call in getattr(message, "tool_calls", None) or []:
+                if call["name"] != "search_documents":
+                    return
+            tokens += (getattr(message, "usage_metadata", None) or {}).get("total_tokens", 0)
+        if not tokens:
+            # No usage reported (e.g. streaming without stream_usage): estimate the prompt + answer
+            stats = self.session.context_stats or {}
+            tokens = (stats.get("tokens", 0) + stats.get("system_tokens", 0)
+                      + self.session.history_tokens + count_tokens(answer))
+        self.answer_cache.put(*key, answer, tokens, seconds)
+
+    def _is_first_turn(self) -> bool:
+        """No messages in the session's thread yet."""
+        state = self.agent.get_state(self.config)
+        return not (state.values or {}).get("messages") if state else True
+
+    def _record_history_tokens(self):
+        """Size of what the checkpointed thread will resend next turn."""
+        state = self.agent.get_state(self.config)
+        messages = (state.values or {}).get("messages", []) if state else []
+        self.session.history_tokens = sum(count_tokens(self._message_text(m)) for m in messages)
+
+    def _report_turn(self, seconds: float):
+        stats = self.session.context_stats or {}
+        if "skipped" in stats:
+            print(f"Turn in {seconds:.2f}s: retrieval skipped ({stats['skipped']}), "
+                  f"system prompt {stats['system_tokens']} tokens, history {self.session.history_tokens} tokens")
+            return
+        print(
+            f"Turn in {seconds:.2f}s: context {stats.get('tokens', 0)}/{stats.get('budget', 0)} tokens "
+            f"({stats.get('chunks', 0)} chunks from {stats.get('documents', 0)} documents, "
+            f"{stats.get('near_empty', 0)} empty, {stats.get('duplicates', 0)} duplicate, "
+            f"{stats.get('trimmed', 0)} trimmed), system prompt {stats.get('system_tokens', 0)} tokens, "
+            f"history {self.session.history_tokens} tokens"
+        )
+
+    def _build_messages(self, query):
+        """
+        Only the user message goes into the thread. The system prompt is the
+        agent's fixed prefix and the retrieved context is added per model call
+        by EphemeralContextMiddleware, so neither piles up in checkpoints.
+        """
+        self.session.turn_context = None
+        self.session.answer_key = None
+
+        # Form values and small talk skip embedding, search and context tokens
+        retrieve, reason = needs_retrieval(query, form_active=self.current_doc is not None)
+        self.route_counts[reason] = self.route_counts.get(reason, 0) + 1
+        if not retrieve:
+            self.session.context_stats = {"skipped": reason, "tokens": 0, "system_tokens": SYSTEM_PROMPT_TOKENS}
+            return [("user", query)]
+
+        search_query = rewrite_query(query)
+        hits = self.retrieve(search_query, CONTEXT_CANDIDATES)
+        context, stats = self.context_builder.build(search_query, hits)
+        stats["system_tokens"] = SYSTEM_PROMPT_TOKENS
+        stats["route"] = reason
+        self.session.context_stats = stats
+        if self.answer_cache is not None and self.current_doc is None and self._is_first_turn():
+            # Only standalone questions: a follow-up ("a jaký je jeho telefon?") means
+            # something different in every thread, and form sessions never use the cache.
+            # The query vector is already cached by retrieve.
+            self.session.answer_key = (self.encode_query(search_query), hits)
+
+        if context:
+            self.session.turn_context = (
+                "Následuje kontext z nemocničních dokumentů. Při odpovědi se drž těchto informací a na konci odpovědi odkaž na příslušné dokumenty.\n\n"
+                f"{context}"
+            )
 
-        return validated_response["messages"][-1].content
+        return [("user", query)]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+class EphemeralContextMiddleware(AgentMiddleware):
+    """
+    Adds the current turn's retrieved context to each model call of that turn,
+    just before the latest user message.
+
+    Only the request sent to the model changes, never the agent state, so the
+    context is not written to checkpoints. The static system prompt plus the
+    history stay an unchanged prefix between turns, so provider-side prompt
+    caching keeps applying.
+    """
+
+    def __init__(self, get_context):
+        super().__init__()
+        self.get_context = get_context
+
+    def _with_context(self, request):
+        context = self.get_context()
+        if not context:
+            return request
+
+        messages = list(request.messages)
+        position = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[i], HumanMessage):
+                position = i
+                break
+        messages.insert(position, SystemMessage(content=context))
+        return request.override(messages=messages)
+
+    def wrap_model_call(self, request, handler):
+        return handler(self._with_context(request))
+
+    async def awrap_model_call(self, request, handler):
+        return await handler(self._with_context(request))
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+import numpy as np
+
+from embedding_cache import normalize_text
+
+try:
+    import hnswlib
+except ImportError:  # optional, only needed for the approximate index
+    hnswlib = None
+
+
+def chunk_fingerprint(content: str) -> str:
+    """
+    Content only: ids are section numbers like "4.4.13" for Word files, which
+    an INTEGER id column (tables created before it became VARCHAR) cannot
+    round-trip, so an id in the fingerprint would make every row look changed.
+    """
+    return hashlib.sha256(normalize_text(content or "").encode("utf-8")).hexdigest()
+
+
+def id_key(chunk_id) -> str:
+    """Comparable form of a chunk id: 6, "6" and "0006" pair up; "3.1" stays as is."""
+    text = str(chunk_id).strip()
+    return str(int(text)) if text.isdigit() else text
+
+
+def diff_chunks(stored: list[tuple], chunks: list[dict]):
+    """
+    Compare stored rows (row_key, id, content) of one file with its new chunks.
+    Returns (unchanged, to_update, to_insert, to_delete):
+      unchanged - [(row_key, chunk)] identical content
+      to_update - [(row_key, chunk)] same id, different content
+      to_insert - [chunk] ids not stored yet
+      to_delete - [row_key] stored rows no longer present (or duplicates)
+    """
+    by_fingerprint = defaultdict(list)
+    for row_key, chunk_id, content in stored:
+        by_fingerprint[chunk_fingerprint(content)].append((row_key, chunk_id))
+
+    unchanged, changed = [], []
+    for chunk in chunks:
+        candidates = by_fingerprint.get(chunk_fingerprint(chunk["content"]))
+        if candidates:
+            unchanged.append((candidates.pop()[0], chunk))
+        else:
+            changed.append(chunk)
+
+    by_id = defaultdict(list)
+    for candidates in by_fingerprint.values():
+        for row_key, chunk_id in candidates:
+            by_id[id_key(chunk_id)].append(row_key)
+
+    to_update, to_insert = [], []
+    for chunk in changed:
+        row_keys = by_id.get(id_key(chunk["id"]))
+        if row_keys:
+            to_update.append((row_keys.pop(), chunk))
+        else:
+            to_insert.append(chunk)
+
+    to_delete = [row_key for row_keys in by_id.values() for row_key in row_keys]
+    return unchanged, to_update, to_insert, to_delete
+
+
+class RetrievalBackend(ABC):
+    """
+    Where chunk vectors live and how top-k search runs.
+    search() returns (filename, content) pairs, best match first.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def search(self, query_vector, top_k: int = 5) -> list[tuple[str, str]]:
+        ...
+
+    @abstractmethod
+    def add_chunks(self, chunks: list[dict], vectors) -> None:
+        ...
+
+    @abstractmethod
+    def sync_file(self, filename: str, chunks: list[dict], encode_fn) -> dict:
+        """
+        Make the stored chunks of filename equal to chunks, embedding only
+        new or changed ones via encode_fn(texts). Returns per-action counts.
+        """
+
+    @abstractmethod
+    def all_chunks(self) -> list[dict]:
+        """Every stored chunk as {id, filename, content}, e.g. to build a lexical index."""
+
+
+# ------------- IRIS ------------- #
+
+class IrisBackend(RetrievalBackend):
+    """
+    Brute-force VECTOR_COSINE ordering inside IRIS.
+    Every call borrows a connection from the shared pool, so searches run
+    concurrently; statement texts are fixed so their cursors are reused.
+    """
+
+    name = "iris"
+
+    # Rows per executemany call; a sync is still committed once at the end
+    WRITE_BATCH_ROWS = int(os.getenv("IRIS_WRITE_BATCH_ROWS", "500"))
+
+    def __init__(self, pool, table_name: str = "VectorSearch.ORGstruct"):
+        self.pool = pool
+        self.table_name = table_name
+        self._table_ready = False
+        self._table_lock = threading.Lock()
+
+        self.search_sql = f"""
+            SELECT TOP ? filename, content
+            FROM {table_name}
+            ORDER BY VECTOR_COSINE(vector, TO_VECTOR(?,DOUBLE)) DESC
+        """
+        # filename is a stream column, which IRIS only compares through SUBSTRING
+        self.select_file_sql = f"""
+            SELECT %ID, id, content FROM {table_name}
+            WHERE SUBSTRING(filename, 1, 1000) = ?
+        """
+        self.insert_sql = f"""
+        INSERT INTO {table_name} (id, filename, content, vector)
+        VALUES (?, ?, ?, TO_VECTOR(?))
+        """
+        self.update_sql = f"UPDATE {table_name} SET content = ?, vector = TO_VECTOR(?) WHERE %ID = ?"
+        self.delete_sql = f"DELETE FROM {table_name} WHERE %ID = ?"
+        self.all_chunks_sql = f"SELECT id, filename, content FROM {table_name}"
+
+    def create_table(self):
+        """CREATE TABLE IF NOT EXISTS, once per process rather than per upload."""
+        if self._table_ready:
+            return
+        with self._table_lock:
+            if self._table_ready:
+                return
+            # id holds section numbers ("3.1") for Word documents, hence VARCHAR
+            create_table_query = f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id VARCHAR(64),
+            filename LONGVARCHAR,
+            content LONGVARCHAR,
+            vector VECTOR(DOUBLE, 384)
+            )
+            """
+
+            def create(conn):
+                conn.execute(create_table_query)
+                conn.commit()
+
+            self.pool.run(create)
+            self._table_ready = True
+
+    def _write_batched(self, conn, sql: str, rows: list) -> None:
+        for start in range(0, len(rows), self.WRITE_BATCH_ROWS):
+            conn.executemany(sql, rows[start:start + self.WRITE_BATCH_ROWS])
+
+    def search(self, query_vector, top_k: int = 5) -> list[tuple[str, str]]:
+        params = [int(top_k), str(list(query_vector))]
+        return self.pool.run(
+            lambda conn: [tuple(row) for row in conn.execute(self.search_sql, params).fetchall()]
+        )
+
+    def add_chunks(self, chunks: list[dict], vectors) -> None:
+        rows_list = [
+            [str(chunk["id"]), chunk["filename"], chunk["content"], str(vector.tolist())]
+            for chunk, vector in zip(chunks, np.asarray(vectors))
+        ]
+        self.create_table()
+
+        def write(conn):
+            self._write_batched(conn, self.insert_sql, rows_list)
+            conn.commit()
+
+        self.pool.run(write)
+
+    def all_chunks(self) -> list[dict]:
+        self.create_table()
+        rows = self.pool.run(lambda conn: conn.execute(self.all_chunks_sql).fetchall())
+        return [{"id": row[0], "filename": row[1], "content": row[2]} for row in rows]
+
+    def sync_file(self, filename: str, chunks: list[dict], encode_fn) -> dict:
+        self.create_table()
+        stored = self.pool.run(
+            lambda conn: [tuple(row) for row in conn.execute(self.select_file_sql, [filename]).fetchall()]
+        )
+        unchanged, to_update, to_insert, to_delete = diff_chunks(stored, chunks)
+
+        # Embed before borrowing a connection so searches are not starved by the model
+        changed = [chunk for _, chunk in to_update] + to_insert
+        vectors = encode_fn([c["content"] for c in changed]) if changed else []
+        vector_strs = [str(np.asarray(v).tolist()) for v in vectors]
+        update_vectors = vector_strs[:len(to_update)]
+        insert_vectors = vector_strs[len(to_update):]
+
+        def write(conn):
+            # One transaction per file; the pool rolls back if any batch fails
+            if to_delete:
+                self._write_batched(conn, self.delete_sql, [[row_key] for row_key in to_delete])
+            if to_update:
+                self._write_batched(conn, self.update_sql, [
+                    [chunk["content"], vector, row_key]
+                    for (row_key, chunk), vector in zip(to_update, update_vectors)
+                ])
+            if to_insert:
+                self._write_batched(conn, self.insert_sql, [
+                    [str(chunk["id"]), filename, chunk["content"], vector]
+                    for chunk, vector in zip(to_insert, insert_vectors)
+                ])
+            conn.commit()
+
+        if to_delete or to_update or to_insert:
+            self.pool.run(write)
+
+        return {
+            "unchanged": len(unchanged),
+            "updated": len(to_update),
+            "inserted": len(to_insert),
+            "deleted": len(to_delete),
+        }
+
+
+# ------------- IN-PROCESS ------------- #
+
+class InMemoryBackend(RetrievalBackend):
+    """
+    All vectors in one contiguous float32 (or int8) matrix.
+    Exact search is a single matrix-vector product; with use_ann and hnswlib
+    installed an HNSW index answers approximately instead.
+    """
+
+    name = "memory"
+
+    def __init__(self, dim: int = 384, quantize: bool = False, use_ann: bool = False):
+        self.dim = dim
+        self.quantize = quantize
+        self.use_ann = use_ann and hnswlib is not None
+        if use_ann and hnswlib is None:
+            print("hnswlib is not installed, falling back to exact search.")
+
+        self.chunks: list[dict] = []
+        self.matrix = np.empty((0, dim), dtype=np.int8 if quantize else np.float32)
+        self.scales = np.empty(0, dtype=np.float32)
+        self._ann = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    # ---- building ----
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _encode_rows(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Symmetric per-row int8 quantization (or passthrough for float32)."""
+        if not self.quantize:
+            return vectors, np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def add_chunks(self, chunks: list[dict], vectors) -> None:
+        """Add chunks; rows previously stored for the same files are replaced."""
+        if not chunks:
+            return
+        vectors = self._normalize(vectors).reshape(len(chunks), self.dim)
+        rows, scales = self._encode_rows(vectors)
+        filenames = {chunk["filename"] for chunk in chunks}
+
+        with self._lock:
+            keep = [i for i, c in enumerate(self.chunks) if c["filename"] not in filenames]
+            self.chunks = [self.chunks[i] for i in keep] + [
+                {"id": c["id"], "filename": c["filename"], "content": c["content"]}
+                for c in chunks
+            ]
+            self.matrix = np.ascontiguousarray(np.concatenate([self.matrix[keep], rows]))
+            self.scales = np.concatenate([self.scales[keep], scales])
+            self._ann = None
+
+    def _stored_rows(self, filename: str) -> list[tuple]:
+        return [(i, c["id"], c["content"]) for i, c in enumerate(self.chunks) if c["filename"] == filename]
+
+    def _embed(self, contents: list[str], encode_fn) -> dict[str, tuple]:
+        """content -> (row, scale) for the given texts."""
+        if not contents:
+            return {}
+        rows, scales = self._encode_rows(
+            self._normalize(encode_fn(contents)).reshape(len(contents), self.dim)
+        )
+        return {content: (rows[n], scales[n]) for n, content in enumerate(contents)}
+
+    def sync_file(self, filename: str, chunks: list[dict], encode_fn) -> dict:
+        # Embed outside the lock so searches are not blocked by the model
+        with self._lock:
+            _, to_update, to_insert, _ = diff_chunks(self._stored_rows(filename), chunks)
+        changed = [chunk for _, chunk in to_update] + to_insert
+        embedded = self._embed(list({c["content"] for c in changed}), encode_fn)
+
+        with self._lock:
+            # Diff again: rows may have moved (or changed) while the model ran
+            unchanged, to_update, to_insert, to_delete = diff_chunks(self._stored_rows(filename), chunks)
+            changed = [chunk for _, chunk in to_update] + to_insert
+            missing = list({c["content"] for c in changed} - embedded.keys())
+            if missing:
+                embedded.update(self._embed(missing, encode_fn))
+
+            if to_update or to_insert or to_delete:
+                # Unchanged rows keep their stored vectors; the rest come from fresh
+                rows, scales, new_chunks = [], [], []
+                for row_key, chunk in unchanged:
+                    rows.append(self.matrix[row_key])
+                    scales.append(self.scales[row_key])
+                    new_chunks.append(self.chunks[row_key])
+                for chunk in changed:
+                    row, scale = embedded[chunk["content"]]
+                    rows.append(row)
+                    scales.append(scale)
+                    new_chunks.append(
+                        {"id": chunk["id"], "filename": filename, "content": chunk["content"]}
+                    )
+
+                keep = [i for i, c in enumerate(self.chunks) if c["filename"] != filename]
+                self.chunks = [self.chunks[i] for i in keep] + new_chunks
+                stacked = np.array(rows, dtype=self.matrix.dtype).reshape(-1, self.dim)
+                self.matrix = np.ascontiguousarray(np.concatenate([self.matrix[keep], stacked]))
+                self.scales = np.concatenate([self.scales[keep], np.array(scales, dtype=np.float32)])
+                self._ann = None
+
+        return {
+            "unchanged": len(unchanged),
+            "updated": len(to_update),
+            "inserted": len(to_insert),
+            "deleted": len(to_delete),
+        }
+
+    def all_chunks(self) -> list[dict]:
+        with self._lock:
+            return list(self.chunks)
+
+    def load_chunks_dir(self, chunks_dir: str, encode_fn) -> int:
+        """Build the index from every *-chunks.json file in chunks_dir."""
+        if not os.path.isdir(chunks_dir):
+            return 0
+        total = 0
+        for name in sorted(os.listdir(chunks_dir)):
+            if not name.endswith("-chunks.json"):
+                continue
+            with open(os.path.join(chunks_dir, name), encoding="utf-8") as f:
+                chunks = [c for c in json.load(f) if c.get("content")]
+            if chunks:
+                self.add_chunks(chunks, encode_fn([c["content"] for c in chunks]))
+                total += len(chunks)
+        print(f"In-memory index built with {total} chunks from {chunks_dir}")
+        return total
+
+    def _build_ann(self):
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=max(len(self.chunks), 1), ef_construction=200, M=16)
+        if self.chunks:
+            index.add_items(self._dequantized(), np.arange(len(self.chunks)))
+        index.set_ef(64)
+        return index
+
+    def _dequantized(self) -> np.ndarray:
+        if not self.quantize:
+            return self.matrix
+        return self.matrix.astype(np.float32) * self.scales[:, None]
+
+    # ---- search ----
+
+    def search(self, query_vector, top_k: int = 5) -> list[tuple[str, str]]:
+        query = self._normalize(query_vector).reshape(-1)
+
+        with self._lock:
+            chunks, matrix, scales = self.chunks, self.matrix, self.scales
+            if not chunks:
+                return []
+            k = min(int(top_k), len(chunks))
+
+            if self.use_ann:
+                if self._ann is None:
+                    self._ann = self._build_ann()
+                labels, _ = self._ann.knn_query(query, k=k)
+                return [(chunks[i]["filename"], chunks[i]["content"]) for i in labels[0]]
+
+        if self.quantize:
+            scores = (matrix @ query) * scales
+        else:
+            scores = matrix @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(chunks[i]["filename"], chunks[i]["content"]) for i in top]
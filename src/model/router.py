@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import re
+
+from .template_catalog import fold_text
+
+# Lines like "Jméno a příjmení: Jan Novák" (a label followed by a value)
+FIELD_VALUE_REGEX = re.compile(r"^\s*[^:?\n]{1,60}:\s*\S.*$")
+# Dates, times, amounts, e-mails, phone numbers, registration plates
+VALUE_REGEX = re.compile(
+    r"^\s*(\d{1,2}\.\s?\d{1,2}\.(\s?\d{2,4})?|\d{1,2}:\d{2}|[\d\s.,]+\s?(kc|czk|km|eur)?|\S+@\S+\.\S+"
+    r"|\+?[\d\s]{9,}|(?=[a-z\s]*\d)[a-z0-9]{1,3}\s?[a-z0-9]{1,5})\s*$"
+)
+
+# Folded (no diacritics) word lists
+QUESTION_WORDS = {
+    "jak", "kdo", "kde", "kdy", "co", "proc", "ktery", "ktera", "ktere", "jaky", "jaka", "jake",
+    "kolik", "muzu", "mohu", "musim", "smim", "postup", "proces", "smernice", "predpis",
+    "pravidla", "kontakt", "vedouci", "oddeleni", "kam", "komu", "odkud",
+}
+CHAT_ONLY = {
+    "ahoj", "dobry den", "dekuji", "dekuju", "diky", "dik", "ok", "okay", "ano", "ne", "jo",
+    "super", "v poradku", "to je vse", "nashledanou", "hotovo",
+}
+DOCUMENT_COMMANDS = (
+    "uloz", "ulozit", "vypln", "vyplnit", "posli", "poslat", "zobraz", "ukaz", "zmen", "zmenit",
+    "oprav", "opravit", "vyber", "zvol", "nahraj", "odesli",
+)
+# Conversational filler removed when rewriting a query for search
+FILLER_REGEX = re.compile(
+    r"\b(prosim( te| vas)?|chtel(a)? bych( vedet| se zeptat)?|muzete mi (rict|poradit)|"
+    r"mohl(a)? byste( mi)?( rict)?|potreboval(a)? bych( vedet)?|rad(a)? bych( vedel(a)?)?|"
+    r"dobry den|ahoj|diky|dekuji|zajimalo by me)\b[,]?",
+)
+
+
+def needs_retrieval(query: str, form_active: bool = False) -> tuple[bool, str]:
+    """
+    Cheap local decision whether a turn needs document context.
+    Returns (retrieve?, reason). Form-filling turns (field values, short
+    answers, document commands) and small talk skip retrieval entirely.
+    """
+    folded = fold_text(query or "").strip()
+    if not folded:
+        return False, "empty"
+
+    words = re.findall(r"\w+", folded)
+    bare = " ".join(words)
+    if bare in CHAT_ONLY:
+        return False, "small talk"
+
+    is_question = "?" in folded or any(word in QUESTION_WORDS for word in words)
+
+    if form_active and not is_question:
+        lines = [line for line in folded.splitlines() if line.strip()]
+        if lines and all(FIELD_VALUE_REGEX.match(line) or VALUE_REGEX.match(line) for line in lines):
+            return False, "form values"
+        if words and words[0].startswith(DOCUMENT_COMMANDS):
+            return False, "document command"
+        if len(words) <= 4:
+            return False, "short answer"
+
+    return True, "question" if is_question else "default"
+
+
+def rewrite_query(query: str) -> str:
+    """Strip conversational filler so the search sees the content words only."""
+    original = (query or "").strip()
+    query = query or ""
+    folded = fold_text(query)
+    if not FILLER_REGEX.search(folded):
+        return original
+    if len(folded) != len(query):
+        # Folding changed the length, spans no longer line up; the folded text will do
+        query = folded
+
+    # Filler matched on folded text; drop the same character spans from the original
+    pieces, last = [], 0
+    for match in FILLER_REGEX.finditer(folded):
+        pieces.append(query[last:match.start()])
+        last = match.end()
+    pieces.append(query[last:])
+    rewritten = re.sub(r"\s+", " ", "".join(pieces)).strip(" ,.")
+    # Nothing but filler ("Díky!"): leftover punctuation is no query
+    return rewritten if re.search(r"\w", rewritten) else original
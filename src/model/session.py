@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from docx import Document
+
+DEFAULT_SESSION_ID = "default"
+
+# Session the current agent run belongs to. Tools read their working
+# document through it, so parallel requests never see each other's state.
+active_session: ContextVar["ChatSession | None"] = ContextVar("active_session", default=None)
+
+
+class ChatSession:
+    """Conversation state of one client: checkpoint thread + working document."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # Fresh thread per session object, so an evicted id never revives old history
+        self.thread_id = f"{session_id}-{uuid.uuid4().hex[:8]}"
+        self.config = {"configurable": {"thread_id": self.thread_id}}
+
+        self.current_doc: Document | None = None
+        self.current_doc_path: str | None = None
+        self.current_doc_name: str | None = None
+        # FormModel index of current_doc, built when the document is loaded
+        self.current_form = None
+        # Edits stay in memory until flush_document writes them out
+        self.doc_dirty = False
+        self.last_flush = time.monotonic()
+
+        # Size report of the RAG context sent with the latest turn
+        self.context_stats: dict | None = None
+        # Retrieved context of the running turn; sent to the model, never checkpointed
+        self.turn_context: str | None = None
+        # (query vector, hits) of the running turn when its answer may be cached
+        self.answer_key: tuple | None = None
+        # Tokens in the checkpointed thread after the latest turn
+        self.history_tokens = 0
+        # Checkpoint size measured after the latest turn (see SessionStore.enforce_memory_cap)
+        self.checkpoint_bytes = 0
+
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # One agent run at a time per session; different sessions run in parallel
+        self.lock = threading.Lock()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def mark_dirty(self):
+        self.doc_dirty = True
+
+    def flush_document(self, force: bool = False) -> bool:
+        """Save current_doc to current_doc_path if dirty (or forced)."""
+        if self.current_doc is None or self.current_doc_path is None:
+            return False
+        if not (self.doc_dirty or force):
+            return False
+        self.current_doc.save(self.current_doc_path)
+        self.doc_dirty = False
+        self.last_flush = time.monotonic()
+        return True
+
+
+def checkpoint_bytes(checkpointer, thread_id: str) -> int:
+    """
+    Approximate memory held by one thread in an InMemorySaver.
+    Sums the serialized checkpoint, write and blob payloads of the thread.
+    The saver's dicts are snapshotted first, since other sessions' agent runs
+    keep inserting into them.
+    """
+    total = 0
+
+    def payload_size(value) -> int:
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        if isinstance(value, tuple):
+            return sum(payload_size(v) for v in value)
+        return 0
+
+    for namespace in list(getattr(checkpointer, "storage", {}).get(thread_id, {}).values()):
+        for saved in list(namespace.values()):
+            total += payload_size(saved)
+
+    for key, writes in list(getattr(checkpointer, "writes", {}).items()):
+        if key[0] == thread_id:
+            for write in list(writes.values()):
+                total += payload_size(write)
+
+    for key, blob in list(getattr(checkpointer, "blobs", {}).items()):
+        if key[0] == thread_id:
+            total += payload_size(blob)
+
+    return total
+
+
+class SessionStore:
+    """
+    LRU/TTL registry of ChatSession objects keyed by client session id.
+    Evicted sessions have their checkpoint thread deleted from the saver.
+    """
+
+    def __init__(
+        self,
+        checkpointer,
+        max_sessions: int = 200,
+        ttl_seconds: float = 3600,
+        max_checkpoint_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.checkpointer = checkpointer
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_checkpoint_bytes = max_checkpoint_bytes
+
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Sum of the sessions' last measured checkpoint sizes
+        self.checkpoint_bytes_total = 0
+
+    def get(self, session_id: str | None) -> ChatSession:
+        """Return the session for the id, creating it if needed (LRU touch)."""
+        session_id = session_id or DEFAULT_SESSION_ID
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ChatSession(session_id)
+                self._sessions[session_id] = session
+            else:
+                self._sessions.move_to_end(session_id)
+            session.touch()
+
+            while len(self._sessions) > self.max_sessions:
+                if not self._evict_oldest(keep=session_id):
+                    # Every other session is busy; exceed the cap until they finish
+                    break
+            return session
+
+    def enforce_memory_cap(self, session: ChatSession) -> int:
+        """
+        Re-measure the session whose turn just finished and evict least
+        recently used sessions until the running total fits the cap. Other
+        threads only change during their own turns, so they are not rescanned.
+        """
+        size = checkpoint_bytes(self.checkpointer, session.thread_id)
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                self.checkpoint_bytes_total += size - session.checkpoint_bytes
+                session.checkpoint_bytes = size
+
+            for sid in list(self._sessions):
+                if self.checkpoint_bytes_total <= self.max_checkpoint_bytes:
+                    break
+                if sid != session.session_id:
+                    self._drop(sid)
+            return self.checkpoint_bytes_total
+
+    def stats(self) -> dict:
+        with self._lock:
+            history = [s.history_tokens for s in self._sessions.values()]
+            return {
+                "sessions": len(self._sessions),
+                "history_tokens_total": sum(history),
+                "history_tokens_max": max(history, default=0),
+                "checkpoint_bytes": self.checkpoint_bytes_total,
+            }
+
+    # ------------- EVICTION ------------- #
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for sid, session in list(self._sessions.items()):
+            if now - session.last_used <= self.ttl_seconds:
+                # Ordered by last use, everything after is fresher
+                break
+            self._drop(sid)
+
+    def _evict_oldest(self, keep: str) -> bool:
+        for sid in list(self._sessions):
+            if sid != keep and self._drop(sid):
+                return True
+        return False
+
+    def _drop(self, session_id: str) -> bool:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        # Never pull state out from under a running agent
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            del self._sessions[session_id]
+            self.checkpoint_bytes_total -= session.checkpoint_bytes
+            try:
+                session.flush_document()
+            except Exception as e:
+                print(f"Failed to save document of session {session_id}: {e}")
+            try:
+                self.checkpointer.delete_thread(session.thread_id)
+            except Exception as e:
+                print(f"Failed to delete checkpoint thread {session.thread_id}: {e}")
+        finally:
+            session.lock.release()
+        return True
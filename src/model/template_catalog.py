@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import io
+import os
+import re
+import time
+import threading
+import unicodedata
+import numpy as np
+
+from docx import Document
+
+from .form_model import FormModel, para_text
+
+# Working copies made by load_word_document: <name>_copy_<8 hex>.docx
+WORKING_COPY_REGEX = re.compile(r"_copy_[0-9a-f]{8}\.docx$", re.IGNORECASE)
+
+
+def fold_text(text: str) -> str:
+    """Lowercase and strip diacritics: 'Žádost o dovolenou' -> 'zadost o dovolenou'."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def char_ngrams(text: str, n: int = 3) -> set[str]:
+    words = re.findall(r"\w+", fold_text(text))
+    grams = set()
+    for word in words:
+        padded = f" {word} "
+        grams.update(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+
+class TemplateEntry:
+    """One parsed .docx template kept in memory."""
+
+    def __init__(self, filename: str, path: str, mtime: float, data: bytes):
+        self.filename = filename
+        self.path = path
+        self.mtime = mtime
+        self.data = data
+
+        doc = Document(io.BytesIO(data))
+        paragraphs = [para_text(p).strip() for p in doc.paragraphs]
+        paragraphs = [p for p in paragraphs if p]
+
+        self.title = paragraphs[0] if paragraphs else os.path.splitext(filename)[0]
+        self.labels = [label for label in FormModel(doc).labels if len(label) <= 80]
+        self.text = "\n".join(paragraphs)
+
+        name = os.path.splitext(filename)[0].replace("_", " ").replace("–", " ")
+        self.search_text = " ".join([name, self.title] + self.labels)
+        self.ngrams = char_ngrams(f"{name} {self.title}")
+        self.label_ngrams = char_ngrams(self.search_text)
+        self.vector: np.ndarray | None = None
+
+    def open(self) -> Document:
+        """Fresh in-memory Document from the cached bytes."""
+        return Document(io.BytesIO(self.data))
+
+
+class TemplateCatalog:
+    """
+    In-memory catalog of the .docx templates in doc_root.
+
+    The directory is re-checked by mtime at most every refresh_seconds and only
+    new or modified files are parsed again. Working copies are ignored.
+    Lookups score templates by character n-gram overlap with the name/title
+    and, if an encoder is given, by embedding similarity of the template text.
+    """
+
+    def __init__(self, doc_root: str | None, encode_fn=None, refresh_seconds: float = 2.0):
+        self.doc_root = doc_root
+        self.encode_fn = encode_fn
+        self.refresh_seconds = refresh_seconds
+
+        self.entries: dict[str, TemplateEntry] = {}
+        self.excluded: set[str] = set()
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---- maintenance ----
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_seconds:
+            return
+
+        with self._lock:
+            self._checked_at = now
+            if not self.doc_root or not os.path.isdir(self.doc_root):
+                self.entries = {}
+                return
+
+            seen = {}
+            with os.scandir(self.doc_root) as it:
+                for item in it:
+                    if (
+                        item.is_file()
+                        and item.name.lower().endswith(".docx")
+                        and not item.name.startswith("~$")
+                        and not WORKING_COPY_REGEX.search(item.name)
+                        and item.name not in self.excluded
+                    ):
+                        seen[item.name] = item.stat().st_mtime
+
+            entries = {}
+            fresh = []
+            for filename, mtime in seen.items():
+                entry = self.entries.get(filename)
+                if entry is None or entry.mtime != mtime:
+                    entry = self._parse(filename, mtime)
+                    if entry is None:
+                        continue
+                    fresh.append(entry)
+                entries[filename] = entry
+
+            if fresh and self.encode_fn is not None:
+                vectors = np.asarray(
+                    self.encode_fn([e.search_text + "\n" + e.text[:1000] for e in fresh]),
+                    dtype=np.float32,
+                )
+                for entry, vector in zip(fresh, vectors):
+                    entry.vector = vector / (np.linalg.norm(vector) or 1.0)
+
+            self.entries = entries
+
+    def _parse(self, filename: str, mtime: float) -> TemplateEntry | None:
+        path = os.path.join(self.doc_root, filename)
+        try:
+            with open(path, "rb") as f:
+                return TemplateEntry(filename, path, mtime, f.read())
+        except Exception as e:
+            print(f"Skipping template '{filename}': {e}")
+            return None
+
+    def exclude(self, filename: str) -> None:
+        """Never offer filename as a template (e.g. a filled form saved next to them)."""
+        with self._lock:
+            self.excluded.add(filename)
+            self.entries.pop(filename, None)
+
+    # ---- lookups ----
+
+    def names(self) -> list[str]:
+        self.refresh()
+        return sorted(self.entries)
+
+    def get(self, filename: str) -> TemplateEntry | None:
+        self.refresh()
+        return self.entries.get(filename)
+
+    def rank(self, query: str, query_vector=None, limit: int = 3) -> list[tuple[float, str]]:
+        """Best matching templates as (score, filename), highest first."""
+        self.refresh()
+        query_grams = char_ngrams(query)
+        if query_vector is not None:
+            query_vector = np.asarray(query_vector, dtype=np.float32)
+            query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+
+        scored = []
+        for filename, entry in self.entries.items():
+            if query_grams:
+                name_score = len(query_grams & entry.ngrams) / len(query_grams | entry.ngrams)
+                label_score = len(query_grams & entry.label_ngrams) / len(query_grams)
+                score = max(name_score, 0.5 * label_score)
+            else:
+                score = 0.0
+            if query_vector is not None and entry.vector is not None:
+                score = 0.5 * score + 0.5 * float(entry.vector @ query_vector)
+            scored.append((score, filename))
+
+        scored.sort(reverse=True)
+        return scored[:limit]
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+import types
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC)
+
+# upload_store and main create their directories/databases at import time
+_scratch = tempfile.mkdtemp(prefix="codemedics-tests-")
+os.environ.setdefault("FILES_PATH", os.path.join(_scratch, "uploads"))
+os.environ.setdefault("INGEST_JOBS_PATH", os.path.join(_scratch, "ingest_jobs.sqlite"))
+
+# The model package's __init__ imports the whole chatbot (LangChain, OpenAI);
+# register it bare so its light submodules (router, form_model, ...) import alone
+if "model" not in sys.modules:
+    package = types.ModuleType("model")
+    package.__path__ = [os.path.join(SRC, "model")]
+    sys.modules["model"] = package
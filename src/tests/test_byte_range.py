@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("dotenv")
+from main import parse_byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-19", (10, 19)),
+    ("bytes=90-200", (90, 99)),      # end past the file is clamped
+    ("bytes=95-", (95, 99)),         # open-ended
+    ("bytes=0-", (0, 99)),
+    ("bytes=-5", (95, 99)),          # suffix
+    ("bytes=-500", (0, 99)),         # suffix longer than the file
+    ("bytes=3-4, 10-20", (3, 4)),    # multi-range: first range only
+    ("BYTES = 1-2", (1, 2)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=100-",      # starts at the end
+    "bytes=150-200",
+    "bytes=20-10",     # reversed
+    "bytes=-0",
+    "bytes=a-b",
+    "bytes=",
+    "items=0-10",
+    "bytes=5--1",
+])
+def test_unsatisfiable_ranges(header):
+    assert parse_byte_range(header, 100) is None
+
+
+def test_empty_file_has_no_satisfiable_range():
+    assert parse_byte_range("bytes=0-", 0) is None
+    assert parse_byte_range("bytes=-5", 0) is None
@@ -0,0 +1,47 @@
+import importlib.util
+import os
+
+from docx import Document
+
+# Loaded by path: importing the model package pulls in the whole chatbot
+_spec = importlib.util.spec_from_file_location(
+    "form_model", os.path.join(os.path.dirname(__file__), "..", "model", "form_model.py")
+)
+form_model = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(form_model)
+
+
+def _form(*lines):
+    doc = Document()
+    for line in lines:
+        doc.add_paragraph(line)
+    return form_model.FormModel(doc), doc
+
+
+def _texts(doc):
+    return [p.text for p in doc.paragraphs]
+
+
+def test_options_after_blank_line():
+    form, doc = _form("Způsob dopravy:", "", "☐ Vlak", "☐ Soukromé vozidlo", "", "Podpis:")
+    assert form.select_option("Způsob dopravy", "Vlak")
+    assert _texts(doc) == ["Způsob dopravy:", "", "☒ Vlak", "", "", "Podpis:"]
+
+
+def test_options_after_instruction_line():
+    form, doc = _form("Způsob dopravy:", "(vyberte)", "☐ Vlak", "☐ Soukromé vozidlo")
+    assert form.select_option("Způsob dopravy", "Soukromé vozidlo")
+    assert _texts(doc) == ["Způsob dopravy:", "(vyberte)", "", "☒ Soukromé vozidlo"]
+
+
+def test_option_lines_are_not_group_labels():
+    form, _ = _form("Způsob dopravy:", "☐ Vlak", "☐ Soukromé vozidlo")
+    assert "☐ vlak" not in form.option_groups
+    assert len(form.option_groups["způsob dopravy"]) == 2
+
+
+def test_changing_the_choice():
+    form, doc = _form("Způsob dopravy:", "☐ Vlak", "☐ Soukromé vozidlo")
+    assert form.select_option("Způsob dopravy", "Vlak")
+    assert form.select_option("Způsob dopravy", "Soukromé vozidlo")
+    assert _texts(doc) == ["Způsob dopravy:", "", "☒ Soukromé vozidlo"]
@@ -0,0 +1,45 @@
+import pytest
+
+from model.router import needs_retrieval, rewrite_query
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("Jméno a příjmení: Jan Novák", "form values"),
+    ("Místo: Brno\nDatum: 5. 1. 2024", "form values"),
+    ("5. 1. 2024", "form values"),
+    ("8:30", "form values"),
+    ("jan.novak@example.cz", "form values"),
+    ("1 250 Kč", "form values"),
+    ("ulož to jako cesta_brno", "document command"),
+    ("vlakem", "short answer"),
+])
+def test_form_turns_skip_retrieval(query, reason):
+    assert needs_retrieval(query, form_active=True) == (False, reason)
+
+
+def test_questions_retrieve_even_during_a_form():
+    assert needs_retrieval("Kdo schvaluje služební cestu?", form_active=True) == (True, "question")
+
+
+def test_form_values_without_a_form_still_retrieve():
+    assert needs_retrieval("Datum: 5. 1. 2024")[0]
+
+
+@pytest.mark.parametrize("query", ["Díky", "Dobrý den", "ok", "  "])
+def test_small_talk_and_empty_skip(query):
+    assert not needs_retrieval(query)[0]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Dobrý den, prosím, chtěla bych vědět, kdo je vedoucí OIAK?", "kdo je vedoucí OIAK?"),
+    ("Můžete mi říct postup pro služební cestu?", "postup pro služební cestu?"),
+    ("Jak vyplnit cestovní příkaz?", "Jak vyplnit cestovní příkaz?"),
+    ("Díky!", "Díky!"),
+    ("", ""),
+])
+def test_rewrite_query_strips_filler(query, expected):
+    assert rewrite_query(query) == expected
+
+
+def test_registration_plate_is_a_form_value():
+    assert needs_retrieval("1B2 3456", form_active=True) == (False, "form values")
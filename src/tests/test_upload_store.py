@@ -0,0 +1,60 @@
+import io
+
+import pytest
+
+from upload_store import MultipartReader, iter_body
+
+BOUNDARY = b"----formboundary42"
+
+
+def _multipart(*parts):
+    body = b""
+    for headers, content in parts:
+        body += b"--" + BOUNDARY + b"\r\n" + headers + b"\r\n\r\n" + content + b"\r\n"
+    return body + b"--" + BOUNDARY + b"--\r\n"
+
+
+def _read(chunks):
+    return [
+        (headers.get_param("name", header="content-disposition"), b"".join(body))
+        for headers, body in MultipartReader(chunks, BOUNDARY).parts()
+    ]
+
+
+BODY = _multipart(
+    (b'Content-Disposition: form-data; name="dateOfCreation"', b"2024-01-05"),
+    (b'Content-Disposition: form-data; name="file"; filename="a.txt"', b"line1\r\n--not-a-boundary\r\nline2"),
+)
+EXPECTED = [("dateOfCreation", b"2024-01-05"), ("file", b"line1\r\n--not-a-boundary\r\nline2")]
+
+
+def test_multipart_in_one_chunk():
+    assert _read([BODY]) == EXPECTED
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(BOUNDARY) + 3])
+def test_multipart_delimiters_split_across_chunks(size):
+    assert _read([BODY[i:i + size] for i in range(0, len(BODY), size)]) == EXPECTED
+
+
+def test_unread_part_is_skipped():
+    parts = MultipartReader([BODY], BOUNDARY).parts()
+    next(parts)
+    headers, body = next(parts)
+    assert b"".join(body) == EXPECTED[1][1]
+
+
+def test_truncated_multipart_raises():
+    with pytest.raises(ValueError):
+        _read([BODY[:-20]])
+
+
+def test_iter_body_reads_exactly_length():
+    rfile = io.BytesIO(b"abcdefghij-next-request")
+    assert b"".join(iter_body(rfile, 10, chunk_size=3)) == b"abcdefghij"
+    assert rfile.read() == b"-next-request"
+
+
+def test_iter_body_short_body_raises():
+    with pytest.raises(ValueError):
+        list(iter_body(io.BytesIO(b"abc"), 10))
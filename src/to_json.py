@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import pandas as pd
+import numpy as np
 import json
 import argparse
 import sys
@@ -41,10 +42,87 @@ department_full_names = {
 }
 
 
-def excel_to_json(excel_file):
+# Characters stripped around cell text (the sheets use "·" bullets and NBSP)
+STRIP_CHARS = " ·\t\xA0"
+
+# Workbooks above this size are read row batch by row batch (openpyxl read-only)
+STREAMING_THRESHOLD_BYTES = int(os.getenv("EXCEL_STREAMING_THRESHOLD_BYTES", str(20 * 1024 * 1024)))
+STREAMING_BATCH_ROWS = 5000
+
+
+def frame_to_contents(df):
+    """
+    Turn every row of a sheet into "col: value; col: value" text, column by
+    column with vectorized string ops. Empty/NaN cells are skipped.
+    Returns a Series of contents (rows without any value are dropped).
     """
-    Convert a single Excel file to JSON (stdout).
+    columns = [str(col).strip().lower() for col in df.columns]
+    joined = pd.Series("", index=df.index, dtype=object)
+
+    for position, col in enumerate(columns):
+        series = df.iloc[:, position]
+        mask = series.notna()
+        if not mask.any():
+            continue
+        values = series[mask]
+        if pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_timedelta64_dtype(series):
+            # str() per value, as the row-wise version did: astype(str) drops the
+            # midnight time of dates ("2024-01-05" vs "2024-01-05 00:00:00")
+            values = values.map(str)
+        values = values.astype(str).str.strip(STRIP_CHARS)
+        values = values[values != ""]
+        if values.empty:
+            continue
+
+        cells = (col + ": " + values).reindex(df.index)
+        has_cell = cells.notna()
+        separator = pd.Series(
+            np.where((joined != "") & has_cell, "; ", ""), index=df.index
+        )
+        joined = joined + separator + cells.fillna("")
+
+    return joined[joined != ""]
+
+
+def iter_sheet_frames(excel_file, streaming=False):
+    """Yield (sheet_name, DataFrame) pairs; in streaming mode several per sheet."""
+    if not streaming:
+        for sheet_name, df in pd.read_excel(excel_file, sheet_name=None).items():
+            yield sheet_name, df
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            header = [
+                f"unnamed: {i}" if name is None else name
+                for i, name in enumerate(header)
+            ]
+
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= STREAMING_BATCH_ROWS:
+                    yield sheet.title, pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield sheet.title, pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def excel_to_json(excel_file, dump=False, streaming=None):
+    """
+    Convert a single Excel file to a list of chunk dicts (one per non-empty row).
     Works with ANY Excel file structure. No required columns.
+    Each chunk records the sheet it came from. Set dump=True to also print
+    the JSON to stdout; streaming=None picks openpyxl read-only mode for big files.
     """
 
     # Validate input path
@@ -60,47 +138,29 @@ def excel_to_json(excel_file):
         print(f"Error: Not a file: {excel_file}", file=sys.stderr)
         return None
 
+    if streaming is None:
+        streaming = os.path.getsize(excel_file) > STREAMING_THRESHOLD_BYTES
+
     print(f"Processing Excel: {excel_file}", file=sys.stderr)
 
     data = []
     chunk_id = 0
 
     try:
-        # Load all sheets into a single dataframe
-        all_sheets = pd.read_excel(excel_file, sheet_name=None)
-        df = pd.concat(all_sheets.values(), ignore_index=True)
-
-        # Normalize column names
-        df.columns = [str(col).strip().lower() for col in df.columns]
-
         filename = os.path.basename(excel_file)
 
-        # Convert rows into chunks
-        for _, row in df.iterrows():
-            chunk_list = []
-
-            for col, value in row.items():
-                if isinstance(value, str):
-                    value_clean = value.strip(" ·\t\xA0")
-                    if value_clean:
-                        chunk_list.append(f"{col}: {value_clean}")
-                elif pd.notna(value):
-                    # Include numeric, datetime, or other clean values
-                    chunk_list.append(f"{col}: {value}")
-
-            if not chunk_list:
-                continue
-
-            data.append({
-                "id": chunk_id,
-                "filename": filename,
-                "content": "; ".join(chunk_list)
-            })
-
-            chunk_id += 1
-
-        # Output to stdout
-        json.dump(data, sys.stdout, indent=4, ensure_ascii=False)
+        for sheet_name, df in iter_sheet_frames(excel_file, streaming=streaming):
+            for content in frame_to_contents(df).tolist():
+                data.append({
+                    "id": chunk_id,
+                    "filename": filename,
+                    "sheet": sheet_name,
+                    "content": content
+                })
+                chunk_id += 1
+
+        if dump:
+            json.dump(data, sys.stdout, indent=4, ensure_ascii=False)
         return data
 
     except Exception as e:
@@ -111,6 +171,8 @@ def excel_to_json(excel_file):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert XLSX to JSON.')
     parser.add_argument('excel_files', nargs='+', type=str, help='Paths to the XLSX files')
+    parser.add_argument('--streaming', action='store_true', help='Read rows in batches (openpyxl read-only mode)')
 
     args = parser.parse_args()
-    excel_to_json(args.excel_files)
+    for excel_file in args.excel_files:
+        excel_to_json(excel_file, dump=True, streaming=args.streaming or None)
@@ -0,0 +1,251 @@
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+import unicodedata
+from email.parser import HeaderParser
+
+# ------------------------------------------
+# LOCATION (resolved once at import)
+# ------------------------------------------
+
+def resolve_upload_dir() -> str:
+    """FILES_PATH if set, otherwise ./uploads next to the server; always absolute."""
+    upload_dir = os.path.abspath(os.getenv("FILES_PATH") or "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
+
+
+UPLOAD_DIR = resolve_upload_dir()
+
+# Upload limits; the body is copied to disk in COPY_CHUNK_BYTES pieces
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+# ------------------------------------------
+# DIRECTORY INDEX
+# ------------------------------------------
+
+class UploadIndex:
+    """
+    In-memory listing of the upload directory.
+    Our own writes show up immediately; a cheap directory mtime check picks up
+    files added or removed by anything else.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._files: dict[str, os.stat_result] = {}
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+        self.rescan()
+
+    def rescan(self) -> None:
+        # mtime first: a file added during the scan leaves it stale, so the next read rescans
+        mtime = os.stat(self.directory).st_mtime_ns
+        files = {}
+        with os.scandir(self.directory) as it:
+            for item in it:
+                # Skip in-progress writes and hidden staging files
+                if item.is_file() and not item.name.startswith(".") and not item.name.endswith(".part"):
+                    files[unicodedata.normalize("NFC", item.name)] = item.stat()
+        with self._lock:
+            self._files = files
+            self._dir_mtime = mtime
+
+    def _refresh_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            os.makedirs(self.directory, exist_ok=True)
+            mtime = None
+        if mtime != self._dir_mtime:
+            self.rescan()
+
+    def add(self, filename: str) -> None:
+        path = os.path.join(self.directory, filename)
+        with self._lock:
+            # The stored mtime stays as is: external changes since the last scan
+            # still trigger a rescan on the next read
+            self._files[unicodedata.normalize("NFC", filename)] = os.stat(path)
+
+    def remove(self, filename: str) -> None:
+        with self._lock:
+            self._files.pop(unicodedata.normalize("NFC", filename), None)
+
+    def stat(self, filename: str) -> os.stat_result | None:
+        self._refresh_if_changed()
+        with self._lock:
+            return self._files.get(filename)
+
+    def names(self) -> list[str]:
+        self._refresh_if_changed()
+        with self._lock:
+            return sorted(self._files)
+
+
+upload_index = UploadIndex(UPLOAD_DIR)
+
+
+# ------------------------------------------
+# ATOMIC MOVE
+# ------------------------------------------
+
+def _unique_name(filename: str) -> str:
+    base, ext = os.path.splitext(filename)
+    return f"{base}_{uuid.uuid4().hex[:8]}{ext}"
+
+
+def move_into_uploads(src_path: str, filename: str | None = None) -> str:
+    """
+    Move a file into UPLOAD_DIR without ever overwriting an existing upload.
+    os.link creates the name only if it is free, so two concurrent moves can
+    never race for the same name; on a clash the file gets a random suffix.
+    Returns the destination path.
+    """
+    filename = unicodedata.normalize("NFC", filename or os.path.basename(src_path))
+
+    # Different filesystem: stage a copy inside UPLOAD_DIR first, then link that
+    staged = None
+    try:
+        if os.stat(src_path).st_dev != os.stat(UPLOAD_DIR).st_dev:
+            staged = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+            shutil.copy2(src_path, staged)
+        link_source = staged or src_path
+
+        candidate = filename
+        while True:
+            dest_path = os.path.join(UPLOAD_DIR, candidate)
+            try:
+                os.link(link_source, dest_path)
+                break
+            except FileExistsError:
+                candidate = _unique_name(filename)
+    finally:
+        if staged and os.path.exists(staged):
+            os.unlink(staged)
+
+    os.unlink(src_path)
+    upload_index.add(candidate)
+    return dest_path
+
+
+# ------------------------------------------
+# STREAMING RECEIVE
+# ------------------------------------------
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def safe_upload_name(filename: str | None) -> str | None:
+    """Client supplied name -> plain NFC file name, or None if unusable."""
+    if not filename:
+        return None
+    name = os.path.basename(unicodedata.normalize("NFC", filename).replace("\\", "/")).strip()
+    if not name or name.startswith(".") or name.endswith(".part"):
+        return None
+    return name
+
+
+def receive_upload(chunks, filename: str, max_bytes: int = MAX_UPLOAD_BYTES) -> dict:
+    """
+    Write an iterable of byte chunks to UPLOAD_DIR/filename.
+    The data goes to a hidden .part file while it is hashed and counted, and is
+    only swapped in under the real name once complete, so readers never see a
+    half written upload. Raises UploadTooLarge past max_bytes.
+    """
+    staged = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(staged, "wb") as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+        dest_path = os.path.join(UPLOAD_DIR, filename)
+        os.replace(staged, dest_path)
+    except BaseException:
+        if os.path.exists(staged):
+            os.unlink(staged)
+        raise
+
+    upload_index.add(filename)
+    return {"path": dest_path, "filename": filename, "size": size, "sha256": digest.hexdigest()}
+
+
+def iter_body(rfile, length: int, chunk_size: int = COPY_CHUNK_BYTES):
+    """Read exactly length bytes from rfile in chunks."""
+    remaining = length
+    while remaining > 0:
+        chunk = rfile.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ValueError("request body ended early")
+        remaining -= len(chunk)
+        yield chunk
+
+
+class MultipartReader:
+    """
+    Minimal streaming multipart/form-data parser.
+    parts() yields (headers, body_chunks) one part at a time; a part's body
+    must be consumed (or is skipped) before the next one is read.
+    """
+
+    MAX_HEADER_BYTES = 16 * 1024
+
+    def __init__(self, chunks, boundary: bytes):
+        self._chunks = iter(chunks)
+        self._delimiter = b"\r\n--" + boundary
+        # Leading CRLF lets the first boundary match the same delimiter
+        self._buffer = b"\r\n"
+
+    def _fill(self):
+        chunk = next(self._chunks, b"")
+        if not chunk:
+            raise ValueError("truncated multipart body")
+        self._buffer += chunk
+
+    def _body(self):
+        delimiter = self._delimiter
+        keep = len(delimiter) - 1
+        while True:
+            idx = self._buffer.find(delimiter)
+            if idx >= 0:
+                if idx:
+                    yield self._buffer[:idx]
+                self._buffer = self._buffer[idx + len(delimiter):]
+                return
+            if len(self._buffer) > keep:
+                yield self._buffer[:-keep]
+                self._buffer = self._buffer[-keep:]
+            self._fill()
+
+    def parts(self):
+        # Preamble before the first boundary is discarded
+        for _ in self._body():
+            pass
+
+        while True:
+            while len(self._buffer) < 2:
+                self._fill()
+            if self._buffer.startswith(b"--"):
+                return
+
+            while (end := self._buffer.find(b"\r\n\r\n")) < 0:
+                if len(self._buffer) > self.MAX_HEADER_BYTES:
+                    raise ValueError("multipart headers too large")
+                self._fill()
+            raw_headers = self._buffer[:end].decode("utf-8", "replace")
+            self._buffer = self._buffer[end + 4:]
+
+            headers = HeaderParser().parsestr(raw_headers.lstrip("\r\n") + "\r\n")
+            body = self._body()
+            yield headers, body
+            for _ in body:
+                pass